@@ -1,7 +1,17 @@
 #!/bin/bash
 RUN_PORT="8000"
+# serves the streaming (server-sent events) endpoints
+STREAM_PORT="8001"
 
 /opt/venv/bin/python manage.py migrate --no-input
 /opt/venv/bin/gunicorn furfolio_site.wsgi --worker-tmp-dir /dev/shm --bind "0.0.0.0:${RUN_PORT}" --daemon
+# notifies followers of new offers in the background, and restarts it if it
+# ever exits
+while true; do
+    /opt/venv/bin/python manage.py notify_offer_followers --forever
+    echo "notify_offer_followers exited with status $?, restarting" >&2
+    sleep 5
+done &
+/opt/venv/bin/gunicorn furfolio_site.asgi:application --worker-class uvicorn.workers.UvicornWorker --worker-tmp-dir /dev/shm --bind "0.0.0.0:${STREAM_PORT}" --daemon
 
 nginx -g 'daemon off;'
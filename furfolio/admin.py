@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import SupportTicket, Notification, ChatMessageNotification, CommissionChat, SupportTicketChat, Chat, ChatMessage, ChatParticipant, User, Offer, Commission, UserFollowingUser, Tag, TagCategory
+from .models import SupportTicket, Notification, ChatMessageNotification, CommissionChat, SupportTicketChat, Chat, ChatArchive, ChatMessage, ChatParticipant, User, Offer, Commission, UserFollowingUser, Tag, TagCategory
 
 admin.site.register(User)
 admin.site.register(Offer)
@@ -13,6 +13,7 @@ admin.site.register(CommissionChat)
 admin.site.register(SupportTicketChat)
 admin.site.register(ChatParticipant)
 admin.site.register(ChatMessage)
+admin.site.register(ChatArchive)
 admin.site.register(Notification)
 admin.site.register(ChatMessageNotification)
 admin.site.register(SupportTicket)
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from django.db import connections
+
+from .queries import chat as chat_queries
+
+logger = logging.getLogger(__name__)
+
+
+class ChatMessageListener:
+    """
+    Listens for chat messages published on the Postgres NOTIFY channel and
+    fans them out to the streams of this process that watch the message's chat.
+
+    There is one listener per process. It owns a single database connection
+    and a daemon thread, which start when the first stream subscribes, so a
+    process that never streams a chat never opens the connection.
+    """
+
+    # how long to wait for a notification before checking the connection again
+    SELECT_TIMEOUT_SECONDS = 5
+    # how long to wait before reconnecting after the connection broke
+    RECONNECT_DELAY_SECONDS = 5
+
+    def __init__(self):
+        # maps a chat pk to the queues of the streams watching that chat,
+        # along with the event loop that owns each queue
+        self._subscribers: dict[int, dict[asyncio.Queue,
+                                          asyncio.AbstractEventLoop]] = dict()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def subscribe(self, chat_pk: int) -> asyncio.Queue:
+        """
+        Returns a queue that receives the pk of every new message in the chat.
+        Must be called from a running event loop.
+        """
+        queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(chat_pk, dict())[queue] = loop
+            self._start()
+        return queue
+
+    def unsubscribe(self, chat_pk: int, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(chat_pk, dict())
+            queues.pop(queue, None)
+            if not queues:
+                self._subscribers.pop(chat_pk, None)
+
+    def dispatch(self, payload: str):
+        """Hands a NOTIFY payload to every stream watching its chat."""
+        try:
+            data = json.loads(payload)
+            chat_pk = int(data["chat"])
+            message_pk = int(data["message"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("ignoring malformed chat notification %r", payload)
+            return
+
+        with self._lock:
+            queues = list(self._subscribers.get(chat_pk, dict()).items())
+        for queue, loop in queues:
+            loop.call_soon_threadsafe(queue.put_nowait, message_pk)
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run,
+            name="chat-message-listener",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("chat message listener lost its connection")
+                time.sleep(self.RECONNECT_DELAY_SECONDS)
+
+    def _listen(self):
+        # a dedicated connection, since LISTEN lasts as long as the session
+        database = connections.create_connection("default")
+        try:
+            database.ensure_connection()
+            database.set_autocommit(True)
+            raw_connection = database.connection
+            with raw_connection.cursor() as cursor:
+                cursor.execute(
+                    f"LISTEN {chat_queries.CHAT_MESSAGE_CHANNEL}")
+            while True:
+                readable, _, _ = select.select(
+                    [raw_connection], [], [], self.SELECT_TIMEOUT_SECONDS)
+                if not readable:
+                    continue
+                raw_connection.poll()
+                while raw_connection.notifies:
+                    notify = raw_connection.notifies.pop(0)
+                    self.dispatch(notify.payload)
+        finally:
+            database.close()
+
+
+listener = ChatMessageListener()
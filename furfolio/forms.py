@@ -60,13 +60,24 @@ class UpdateUserProfileForm(forms.ModelForm):
 class UpdateUserAccountForm(forms.ModelForm):
     class Meta:
         model = User
-        fields = ["consent_to_adult_content"]
+        fields = [
+            "consent_to_adult_content",
+            "notify_of_chat_messages",
+            "notify_of_new_offers",
+            "notify_of_commission_changes",
+            "notify_of_followers",
+            "email_notification_digest",
+        ]
 
 
 class UserSearchForm(TextSearchForm):
     pass
 
 
+class ChatMessageSearchForm(TextSearchForm):
+    pass
+
+
 class CommissionSearchForm(forms.Form):
     template_name = "furfolio/form_templates/grid.html"
     search = forms.CharField(max_length=300, required=False)
@@ -1 +0,0 @@
-from .notifications import *
@@ -0,0 +1,26 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...queries import chat as chat_queries
+
+
+class Command(BaseCommand):
+    help = "Moves the messages of inactive chats of finished or rejected commissions into compressed archives."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=180,
+            help="Archive chats without a message for this many days.",
+        )
+
+    def handle(self, *args, **options):
+        inactive_since = timezone.now() - datetime.timedelta(days=options["days"])
+        archived = 0
+        for chat in chat_queries.get_chats_to_archive(inactive_since).iterator():
+            chat_queries.archive_chat(chat)
+            archived += 1
+        self.stdout.write(f"Archived {archived} chats.")
@@ -0,0 +1,45 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...queries import notifications as notification_queries
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Notifies the followers of the authors of new offers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--forever",
+            action="store_true",
+            help="Keep checking for new offers instead of exiting when done.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="With --forever, how many seconds to wait between checks.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                finished = notification_queries.notify_pending_offer_followers()
+            except Exception:
+                if not options["forever"]:
+                    raise
+                # a failed chunk is retried on the next check, so one bad
+                # offer or a dropped connection does not stop the worker
+                logger.exception("could not notify offer followers")
+                close_old_connections()
+            else:
+                if finished or not options["forever"]:
+                    self.stdout.write(
+                        f"Notified the followers of {finished} offers.")
+            if not options["forever"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,24 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...queries import notifications as notification_queries
+
+
+class Command(BaseCommand):
+    help = "Deletes seen notifications older than NOTIFICATION_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.NOTIFICATION_RETENTION_DAYS,
+            help="Delete seen notifications older than this many days.",
+        )
+
+    def handle(self, *args, **options):
+        seen_before = timezone.now() - datetime.timedelta(days=options["days"])
+        purged = notification_queries.purge_seen_notifications(seen_before)
+        self.stdout.write(f"Purged {purged} notifications.")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from ... import models
+
+
+class Command(BaseCommand):
+    help = "Renders the HTML of chat messages that were saved without it. Migrations render existing messages, so this is for rendering them again with --all after rendering changes."
+
+    BATCH_SIZE = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Render every chat message again, not just unrendered ones.",
+        )
+
+    def handle(self, *args, **options):
+        messages = models.ChatMessage.objects.only("pk", "message")
+        if not options["all"]:
+            messages = messages.filter(message_html="")
+
+        batch = []
+        rendered = 0
+        for message in messages.order_by("pk").iterator(chunk_size=self.BATCH_SIZE):
+            message.message_html = message.render_message_html()
+            batch.append(message)
+            if len(batch) >= self.BATCH_SIZE:
+                rendered += self.save_batch(batch)
+                batch = []
+        rendered += self.save_batch(batch)
+        self.stdout.write(f"Rendered {rendered} chat messages.")
+
+    def save_batch(self, batch: list['models.ChatMessage']) -> int:
+        # bulk_update does not call save, so no notifications are sent again
+        models.ChatMessage.objects.bulk_update(batch, ["message_html"])
+        return len(batch)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...queries import notifications as notification_queries
+
+
+class Command(BaseCommand):
+    help = "Recounts the unread notifications of every user."
+
+    def handle(self, *args, **options):
+        repaired = notification_queries.repair_num_unread_notifications_for_users()
+        self.stdout.write(f"Repaired the unread notification count of {repaired} users.")
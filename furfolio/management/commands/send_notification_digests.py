@@ -0,0 +1,64 @@
+import logging
+
+from django.conf import settings
+from django.core import mail
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import pluralize
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from ... import utils
+from ...queries import notifications as notification_queries
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Emails each user who opted in a digest of their unread notifications that were not in an earlier digest."
+
+    def handle(self, *args, **options):
+        notifications_url = utils.add_domain_and_scheme_to_url(
+            reverse("notifications"))
+        sent = 0
+        # one connection for every digest, instead of one per email
+        with mail.get_connection() as connection:
+            for users in notification_queries.get_notification_digests():
+                sent_users = list()
+                for user in users:
+                    message = self.make_digest_message(
+                        user, notifications_url, connection)
+                    try:
+                        message.send()
+                    except Exception:
+                        logger.exception(
+                            "could not send notification digest to user %s", user.pk)
+                        continue
+                    sent_users.append(user)
+                notification_queries.set_notification_digests_sent(sent_users)
+                sent += len(sent_users)
+        self.stdout.write(f"Sent {sent} notification digests.")
+
+    def make_digest_message(self, user, notifications_url, connection):
+        num_notifications = user.num_digest_notifications
+        context = {
+            "user": user,
+            "notifications": user.digest_notifications,
+            "num_notifications": num_notifications,
+            "num_more": num_notifications - len(user.digest_notifications),
+            "notifications_url": notifications_url,
+            "update_account_url": utils.add_domain_and_scheme_to_url(
+                reverse("update_user_account", kwargs={"username": user.username})),
+        }
+        message = mail.EmailMultiAlternatives(
+            subject=f"{user.username}, you have {num_notifications} new notification{pluralize(num_notifications)}",
+            body=render_to_string(
+                "furfolio/email/notifications/digest.txt", context),
+            from_email=settings.EMAIL_FROM_ADDRESS,
+            to=[user.email],
+            connection=connection,
+        )
+        message.attach_alternative(
+            render_to_string("furfolio/email/notifications/digest.html", context),
+            "text/html",
+        )
+        return message
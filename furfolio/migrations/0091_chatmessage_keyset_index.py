@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0090_chatparticipant_role"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["chat", "created_date", "id"], name="chat_message_keyset_index"
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.10 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+def set_chat_kinds(apps, schema_editor):
+    Chat = apps.get_model("furfolio", "Chat")
+    Chat.objects.filter(commissionchat__isnull=False).update(kind="COMMISSION")
+    Chat.objects.filter(supportticketchat__isnull=False).update(kind="SUPPORT_TICKET")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0091_chatmessage_keyset_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("GENERIC", "Generic"),
+                    ("COMMISSION", "Commission"),
+                    ("SUPPORT_TICKET", "Support Ticket"),
+                ],
+                default="GENERIC",
+                editable=False,
+                max_length=14,
+            ),
+        ),
+        migrations.RunPython(set_chat_kinds, migrations.RunPython.noop),
+    ]
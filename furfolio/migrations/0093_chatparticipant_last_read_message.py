@@ -0,0 +1,39 @@
+# Generated by Django 4.2.10 on 2026-10-18 09:40
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def set_read_cursors(apps, schema_editor):
+    # unread state of existing messages stays with their notifications, so
+    # the history of every chat starts out as read
+    ChatParticipant = apps.get_model("furfolio", "ChatParticipant")
+    ChatMessage = apps.get_model("furfolio", "ChatMessage")
+    newest_message = ChatMessage.objects.filter(
+        chat=OuterRef("chat"),
+    ).order_by("-pk").values("pk")[:1]
+    ChatParticipant.objects.update(last_read_message=Subquery(newest_message))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0092_chat_kind"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatparticipant",
+            name="last_read_message",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="furfolio.chatmessage",
+            ),
+        ),
+        migrations.RunPython(set_read_cursors, migrations.RunPython.noop),
+    ]
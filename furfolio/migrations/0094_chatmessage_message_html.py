@@ -0,0 +1,17 @@
+# Generated by Django 4.2.10 on 2026-10-18 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0093_chatparticipant_last_read_message"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="message_html",
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0094_chatmessage_message_html"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("seen", False)),
+                fields=["recipient"],
+                name="notification_unseen_index",
+            ),
+        ),
+    ]
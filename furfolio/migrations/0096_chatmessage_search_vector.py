@@ -0,0 +1,42 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0095_notification_unseen_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunSQL(
+            sql="""
+                CREATE TRIGGER furfolio_chatmessage_search_vector_trigger
+                BEFORE INSERT OR UPDATE OF message ON furfolio_chatmessage
+                FOR EACH ROW EXECUTE FUNCTION
+                tsvector_update_trigger(search_vector, 'pg_catalog.english', message);
+
+                UPDATE furfolio_chatmessage
+                SET search_vector = to_tsvector('pg_catalog.english', message);
+            """,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS furfolio_chatmessage_search_vector_trigger
+                ON furfolio_chatmessage;
+            """,
+        ),
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="chat_message_search_index"
+            ),
+        ),
+    ]
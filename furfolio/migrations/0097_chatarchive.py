@@ -0,0 +1,30 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0096_chatmessage_search_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatArchive",
+            fields=[
+                (
+                    "chat",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="furfolio.chat",
+                    ),
+                ),
+                ("messages_file", models.FileField(upload_to="chat_archives/")),
+                ("message_count", models.PositiveIntegerField()),
+                ("created_date", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 4.2.10 on 2026-10-18 13:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.utils.text import Truncator
+import django.db.models.deletion
+
+
+def create_chat_summaries(apps, schema_editor):
+    Chat = apps.get_model("furfolio", "Chat")
+    ChatMessage = apps.get_model("furfolio", "ChatMessage")
+    ChatSummary = apps.get_model("furfolio", "ChatSummary")
+    last_message = ChatMessage.objects.filter(
+        chat=OuterRef("pk")).order_by("-pk")
+    chats = Chat.objects.annotate(
+        last_message_pk=Subquery(last_message.values("pk")[:1]),
+        last_message_author_pk=Subquery(last_message.values("author")[:1]),
+        last_message_text=Subquery(last_message.values("message")[:1]),
+        last_message_created_date=Subquery(
+            last_message.values("created_date")[:1]),
+        message_count=Count("chatmessage"),
+    )
+    summaries = []
+    for chat in chats.iterator():
+        summaries.append(ChatSummary(
+            chat_id=chat.pk,
+            last_message_id=chat.last_message_pk,
+            last_message_author_id=chat.last_message_author_pk,
+            last_message_preview=Truncator(
+                chat.last_message_text or "").chars(100),
+            last_message_date=chat.last_message_created_date,
+            message_count=chat.message_count,
+        ))
+        if len(summaries) >= 500:
+            ChatSummary.objects.bulk_create(summaries)
+            summaries = []
+    ChatSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("furfolio", "0097_chatarchive"),
+    ]
+
+    operations = [
+        # read cursors start at the newest message, so nothing is unread
+        migrations.AddField(
+            model_name="chatparticipant",
+            name="unread_message_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name="ChatSummary",
+            fields=[
+                (
+                    "chat",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="furfolio.chat",
+                    ),
+                ),
+                (
+                    "last_message_preview",
+                    models.CharField(blank=True, max_length=100),
+                ),
+                (
+                    "last_message_date",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+                ("message_count", models.PositiveIntegerField(default=0)),
+                (
+                    "last_message",
+                    models.ForeignKey(
+                        blank=True,
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="furfolio.chatmessage",
+                    ),
+                ),
+                (
+                    "last_message_author",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_chat_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.10 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0098_chatsummary_chatparticipant_unread_message_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="attachment_preview",
+            field=models.FileField(
+                blank=True, editable=False, upload_to="chat_attachment_previews/"
+            ),
+        ),
+    ]
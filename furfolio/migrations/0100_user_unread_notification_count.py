@@ -0,0 +1,34 @@
+# Generated by Django 4.2.10 on 2026-10-18 14:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_unread_notifications(apps, schema_editor):
+    User = apps.get_model("furfolio", "User")
+    Notification = apps.get_model("furfolio", "Notification")
+    unread_counts = Notification.objects.filter(
+        recipient=OuterRef("pk"),
+        seen=False,
+    ).order_by().values("recipient").annotate(
+        count=Count("pk"),
+    ).values("count")
+    User.objects.update(
+        unread_notification_count=Coalesce(Subquery(unread_counts), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0099_chatmessage_attachment_preview"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="unread_notification_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            count_unread_notifications, migrations.RunPython.noop),
+    ]
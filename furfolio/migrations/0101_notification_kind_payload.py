@@ -0,0 +1,94 @@
+# Generated by Django 4.2.10 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+# fills in the kind and payload of existing notifications from their subtype
+# rows, with one joined UPDATE per subtype
+FILL_KINDS_AND_PAYLOADS_SQL = """
+    UPDATE furfolio_notification AS notification
+    SET kind = 'CHAT_MESSAGE',
+        payload = jsonb_build_object(
+            'chat', message.chat_id,
+            'message', message.id,
+            'author', message.author_id)
+    FROM furfolio_chatmessagenotification AS subtype
+    JOIN furfolio_chatmessage AS message ON message.id = subtype.message_id
+    WHERE subtype.notification_id = notification.id;
+
+    UPDATE furfolio_notification AS notification
+    SET kind = 'OFFER_POSTED',
+        payload = jsonb_build_object(
+            'offer', offer.id,
+            'author', offer.author_id)
+    FROM furfolio_offerpostednotification AS subtype
+    JOIN furfolio_offer AS offer ON offer.id = subtype.offer_id
+    WHERE subtype.notification_id = notification.id;
+
+    UPDATE furfolio_notification AS notification
+    SET kind = 'COMMISSION_STATE',
+        payload = jsonb_build_object(
+            'commission', commission.id,
+            'offer', commission.offer_id,
+            'state', subtype.state)
+    FROM furfolio_commissionstatenotification AS subtype
+    JOIN furfolio_commission AS commission
+        ON commission.id = subtype.commission_id
+    WHERE subtype.notification_id = notification.id;
+
+    UPDATE furfolio_notification AS notification
+    SET kind = 'COMMISSION_CREATED',
+        payload = jsonb_build_object(
+            'commission', commission.id,
+            'offer', commission.offer_id,
+            'commissioner', commission.commissioner_id)
+    FROM furfolio_commissioncreatednotification AS subtype
+    JOIN furfolio_commission AS commission
+        ON commission.id = subtype.commission_id
+    WHERE subtype.notification_id = notification.id;
+
+    UPDATE furfolio_notification AS notification
+    SET kind = 'USER_FOLLOWED',
+        payload = jsonb_build_object('follower', subtype.follower_id)
+    FROM furfolio_userfollowednotification AS subtype
+    WHERE subtype.notification_id = notification.id;
+
+    UPDATE furfolio_notification AS notification
+    SET kind = 'SUPPORT_TICKET_STATE',
+        payload = jsonb_build_object(
+            'support_ticket', subtype.support_ticket_id,
+            'state', subtype.support_ticket_state)
+    FROM furfolio_supportticketstatenotification AS subtype
+    WHERE subtype.notification_id = notification.id;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0100_user_unread_notification_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("CHAT_MESSAGE", "Chat Message"),
+                    ("OFFER_POSTED", "Offer Posted"),
+                    ("COMMISSION_STATE", "Commission State"),
+                    ("COMMISSION_CREATED", "Commission Created"),
+                    ("USER_FOLLOWED", "User Followed"),
+                    ("SUPPORT_TICKET_STATE", "Support Ticket State"),
+                ],
+                default="",
+                max_length=20,
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="payload",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunSQL(FILL_KINDS_AND_PAYLOADS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.10 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0101_notification_kind_payload"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("seen", True)),
+                fields=["created_date"],
+                name="notification_seen_date_index",
+            ),
+        ),
+    ]
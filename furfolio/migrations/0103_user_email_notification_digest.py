@@ -0,0 +1,26 @@
+# Generated by Django 4.2.10 on 2026-10-18 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0102_notification_seen_date_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="email_notification_digest",
+            field=models.BooleanField(
+                default=False,
+                help_text="Periodically receive an email listing the notifications you have not seen yet.",
+                verbose_name="Email me a digest of unread notifications",
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="last_digest_notification_id",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.10 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def set_notification_chats(apps, schema_editor):
+    ChatMessageNotification = apps.get_model(
+        "furfolio", "ChatMessageNotification")
+    ChatMessage = apps.get_model("furfolio", "ChatMessage")
+    message_chat = ChatMessage.objects.filter(
+        pk=OuterRef("message"),
+    ).values("chat")[:1]
+    ChatMessageNotification.objects.update(chat=Subquery(message_chat))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0103_user_email_notification_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessagenotification",
+            name="chat",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="furfolio.chat",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatmessagenotification",
+            name="message_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(set_notification_chats, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="chatmessagenotification",
+            name="chat",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                to="furfolio.chat",
+            ),
+        ),
+    ]
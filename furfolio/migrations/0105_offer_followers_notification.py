@@ -0,0 +1,30 @@
+# Generated by Django 4.2.10 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0104_chatmessagenotification_chat_and_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="offer",
+            name="followers_notification_pending",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name="offer",
+            name="last_notified_follower_id",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="offer",
+            index=models.Index(
+                condition=models.Q(("followers_notification_pending", True)),
+                fields=["id"],
+                name="offer_followers_pending_index",
+            ),
+        ),
+    ]
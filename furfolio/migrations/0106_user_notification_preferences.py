@@ -0,0 +1,41 @@
+# Generated by Django 4.2.10 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0105_offer_followers_notification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="notify_of_chat_messages",
+            field=models.BooleanField(
+                default=True, verbose_name="Notify me of chat messages"
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="notify_of_commission_changes",
+            field=models.BooleanField(
+                default=True,
+                verbose_name="Notify me of new commissions and commission state changes",
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="notify_of_followers",
+            field=models.BooleanField(
+                default=True, verbose_name="Notify me when someone follows me"
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="notify_of_new_offers",
+            field=models.BooleanField(
+                default=True, verbose_name="Notify me of new offers by users I follow"
+            ),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:30
+
+from django.db import migrations
+
+NOTIFICATION_SUBTYPE_TABLES = [
+    "furfolio_chatmessagenotification",
+    "furfolio_offerpostednotification",
+    "furfolio_commissionstatenotification",
+    "furfolio_commissioncreatednotification",
+    "furfolio_userfollowednotification",
+    "furfolio_supportticketstatenotification",
+]
+
+# deleting subtype rows deletes their parent notifications, and deleting
+# notifications lowers the unread counts of their recipients. the triggers run
+# once per statement with every deleted row, so deleting thousands of
+# notifications takes a handful of statements
+CREATE_FUNCTIONS_SQL = """
+    CREATE FUNCTION furfolio_delete_notification_parents() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM furfolio_notification
+        WHERE id IN (SELECT notification_id FROM deleted_rows);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE FUNCTION furfolio_decrement_unread_notification_counts() RETURNS trigger AS $$
+    BEGIN
+        UPDATE furfolio_user
+        SET unread_notification_count = GREATEST(
+            furfolio_user.unread_notification_count - deleted.count, 0)
+        FROM (
+            SELECT recipient_id, count(*) AS count
+            FROM deleted_rows
+            WHERE NOT seen
+            GROUP BY recipient_id
+        ) AS deleted
+        WHERE furfolio_user.id = deleted.recipient_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER furfolio_notification_delete_trigger
+    AFTER DELETE ON furfolio_notification
+    REFERENCING OLD TABLE AS deleted_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION
+    furfolio_decrement_unread_notification_counts();
+"""
+
+DROP_FUNCTIONS_SQL = """
+    DROP TRIGGER IF EXISTS furfolio_notification_delete_trigger
+    ON furfolio_notification;
+    DROP FUNCTION IF EXISTS furfolio_decrement_unread_notification_counts();
+    DROP FUNCTION IF EXISTS furfolio_delete_notification_parents();
+"""
+
+CREATE_SUBTYPE_TRIGGERS_SQL = "".join(
+    f"""
+    CREATE TRIGGER {table}_delete_trigger
+    AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS deleted_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION furfolio_delete_notification_parents();
+    """
+    for table in NOTIFICATION_SUBTYPE_TABLES
+)
+
+DROP_SUBTYPE_TRIGGERS_SQL = "".join(
+    f"""
+    DROP TRIGGER IF EXISTS {table}_delete_trigger ON {table};
+    """
+    for table in NOTIFICATION_SUBTYPE_TABLES
+)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0106_user_notification_preferences"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=CREATE_FUNCTIONS_SQL + CREATE_SUBTYPE_TRIGGERS_SQL,
+            reverse_sql=DROP_SUBTYPE_TRIGGERS_SQL + DROP_FUNCTIONS_SQL,
+        ),
+    ]
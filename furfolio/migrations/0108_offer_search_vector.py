@@ -0,0 +1,57 @@
+# Generated by Django 4.2.10 on 2026-10-18 09:13
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0107_notification_delete_triggers"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="offer",
+            name="offer_name_description_index",
+        ),
+        migrations.AddField(
+            model_name="offer",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION furfolio_offer_search_vector_update() RETURNS trigger AS $$
+                BEGIN
+                    NEW.search_vector :=
+                        setweight(to_tsvector('pg_catalog.english', coalesce(NEW.name, '')), 'A')
+                        || setweight(to_tsvector('pg_catalog.english', coalesce(NEW.description, '')), 'A');
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER furfolio_offer_search_vector_trigger
+                BEFORE INSERT OR UPDATE OF name, description ON furfolio_offer
+                FOR EACH ROW EXECUTE FUNCTION furfolio_offer_search_vector_update();
+
+                UPDATE furfolio_offer
+                SET search_vector =
+                    setweight(to_tsvector('pg_catalog.english', coalesce(name, '')), 'A')
+                    || setweight(to_tsvector('pg_catalog.english', coalesce(description, '')), 'A');
+            """,
+            reverse_sql="""
+                DROP TRIGGER IF EXISTS furfolio_offer_search_vector_trigger
+                ON furfolio_offer;
+                DROP FUNCTION IF EXISTS furfolio_offer_search_vector_update();
+            """,
+        ),
+        migrations.AddIndex(
+            model_name="offer",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fastupdate=False, fields=["search_vector"], name="offer_search_index"
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.10 on 2026-10-18 14:00
+
+from django.db import migrations
+from django.utils.html import urlize
+
+BATCH_SIZE = 500
+
+
+def render_message_html(apps, schema_editor):
+    # historical models lack render_message_html, so this renders the same
+    # way ChatMessage.render_message_html does
+    ChatMessage = apps.get_model("furfolio", "ChatMessage")
+    messages = ChatMessage.objects.filter(
+        message_html="",
+    ).only("pk", "message").order_by("pk")
+    batch = []
+    for message in messages.iterator(chunk_size=BATCH_SIZE):
+        message.message_html = urlize(
+            message.message, nofollow=True, autoescape=True)
+        batch.append(message)
+        if len(batch) >= BATCH_SIZE:
+            ChatMessage.objects.bulk_update(batch, ["message_html"])
+            batch = []
+    ChatMessage.objects.bulk_update(batch, ["message_html"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0108_offer_search_vector"),
+    ]
+
+    operations = [
+        migrations.RunPython(render_message_html, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.10 on 2026-10-18 14:20
+
+from django.db import migrations, models, transaction
+
+
+def move_archives_into_database(apps, schema_editor):
+    # the archive files sit in public media storage, so copy them into the
+    # database, and delete them once the copies are committed
+    ChatArchive = apps.get_model("furfolio", "ChatArchive")
+    for archive in ChatArchive.objects.iterator():
+        with archive.messages_file.open("rb") as messages_file:
+            archive.messages_data = messages_file.read()
+        archive.save(update_fields=["messages_data"])
+        transaction.on_commit(
+            lambda messages_file=archive.messages_file:
+                messages_file.delete(save=False))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0109_render_chat_message_html"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatarchive",
+            name="messages_data",
+            field=models.BinaryField(default=b""),
+            preserve_default=False,
+        ),
+        migrations.RunPython(
+            move_archives_into_database, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="chatarchive",
+            name="messages_file",
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.10 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+# the watermark becomes the created date of the newest notification that
+# was in a digest, which is the newest one at or below the old pk watermark
+FILL_LAST_DIGEST_DATES_SQL = """
+    UPDATE furfolio_user
+    SET last_digest_date = (
+        SELECT max(notification.created_date)
+        FROM furfolio_notification AS notification
+        WHERE notification.recipient_id = furfolio_user.id
+            AND notification.id <= furfolio_user.last_digest_notification_id
+    )
+    WHERE furfolio_user.last_digest_notification_id > 0;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("furfolio", "0110_chatarchive_messages_data"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="last_digest_date",
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunSQL(FILL_LAST_DIGEST_DATES_SQL, migrations.RunSQL.noop),
+        migrations.RemoveField(
+            model_name="user",
+            name="last_digest_notification_id",
+        ),
+    ]
@@ -1,8 +1,13 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
 from django.conf import settings
 from django.urls import reverse
 from django.utils import timesince
+from django.utils.html import urlize
+from django.utils.safestring import mark_safe
 import math
+from pathlib import Path
 
 from .. import validators as furfolio_validators
 from .commissions import Commission
@@ -12,31 +17,69 @@ from ..queries import notifications as notification_queries
 
 
 class Chat(models.Model):
+    KIND_GENERIC = "GENERIC"
+    KIND_COMMISSION = "COMMISSION"
+    KIND_SUPPORT_TICKET = "SUPPORT_TICKET"
+    KIND_CHOICES = [
+        (KIND_GENERIC, "Generic"),
+        (KIND_COMMISSION, "Commission"),
+        (KIND_SUPPORT_TICKET, "Support Ticket"),
+    ]
+    # the kind stored for chats of this class; overridden by each subtype
+    CHAT_KIND = KIND_GENERIC
+
+    kind = models.CharField(
+        max_length=14,
+        choices=KIND_CHOICES,
+        default=KIND_GENERIC,
+        editable=False,
+    )
+
     created_date = models.DateTimeField(name="created_date", auto_now_add=True)
     updated_date = models.DateTimeField(name="updated_date", auto_now=True)
 
     def __str__(self):
         return self.get_name()
 
-    def get_name(self):
-        # for each possible child model of Chat, try to get the name
-        try:
-            return self.commissionchat.get_name()
-        except CommissionChat.DoesNotExist:
-            pass
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.kind = self.CHAT_KIND
+            with transaction.atomic(savepoint=False):
+                save_return = super().save(*args, **kwargs)
+                ChatSummary.objects.create(chat=self)
+            return save_return
+        return super().save(*args, **kwargs)
 
-        try:
-            return self.supportticketchat.get_name()
-        except SupportTicketChat.DoesNotExist:
-            pass
+    def get_concrete_chat(self) -> 'Chat':
+        """
+        Returns this chat as its subtype, like CommissionChat.
+        The stored kind tells which subtype to load, so this runs at most one
+        query, and none if the subtype was loaded by
+        chat_queries.resolve_concrete_chats.
+        """
+        if type(self) is not Chat:
+            return self
+        match self.kind:
+            case Chat.KIND_COMMISSION:
+                return self.commissionchat
+            case Chat.KIND_SUPPORT_TICKET:
+                return self.supportticketchat
+            case _:
+                return self
 
-        return "Generic Chat"
+    def get_name(self):
+        concrete_chat = self.get_concrete_chat()
+        if concrete_chat is self:
+            return "Generic Chat"
+        return concrete_chat.get_name()
 
     def get_participants(self):
         return chat_queries.get_chat_participants(self)
 
 
 class CommissionChat(Chat):
+    CHAT_KIND = Chat.KIND_COMMISSION
+
     commission = models.ForeignKey(
         Commission,
         on_delete=models.CASCADE,
@@ -47,6 +90,8 @@ class CommissionChat(Chat):
 
 
 class SupportTicketChat(Chat):
+    CHAT_KIND = Chat.KIND_SUPPORT_TICKET
+
     support_ticket = models.ForeignKey(
         SupportTicket,
         on_delete=models.CASCADE,
@@ -76,6 +121,23 @@ class ChatParticipant(models.Model):
         choices=ROLE_CHOICES,
         default=ROLE_BASIC,
     )
+    # the newest message this participant has seen in the chat.
+    # only its pk is ever compared, so it is not constrained and deleting
+    # the message leaves the cursor where it was
+    last_read_message = models.ForeignKey(
+        "ChatMessage",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+    )
+    # how many messages of others are newer than last_read_message
+    unread_message_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+    )
 
     created_date = models.DateTimeField(name="created_date", auto_now_add=True)
     updated_date = models.DateTimeField(name="updated_date", auto_now=True)
@@ -88,6 +150,9 @@ class ChatMessage(models.Model):
 
     MESSAGE_MAX_LENGTH = math.ceil(
         settings.AVERAGE_CHARACTERS_PER_WORD * 350)
+    # attachments with these suffixes are shown with a preview
+    IMAGE_ATTACHMENT_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+    ATTACHMENT_PREVIEW_SIZE = 400
 
     chat = models.ForeignKey(
         Chat,
@@ -103,6 +168,12 @@ class ChatMessage(models.Model):
         name="message",
         max_length=MESSAGE_MAX_LENGTH,
     )
+    # the message rendered as HTML, so chats do not escape and urlize the
+    # same text every time they present it
+    message_html = models.TextField(
+        blank=True,
+        editable=False,
+    )
     attachment = models.FileField(
         name="attachment",
         blank=True,
@@ -110,10 +181,33 @@ class ChatMessage(models.Model):
             furfolio_validators.validate_commission_message_attachment_has_max_size,
         ]
     )
+    # a small rendition of an image attachment, made when first requested
+    attachment_preview = models.FileField(
+        upload_to="chat_attachment_previews/",
+        blank=True,
+        editable=False,
+    )
 
     created_date = models.DateTimeField(name="created_date", auto_now_add=True)
     updated_date = models.DateTimeField(name="updated_date", auto_now=True)
 
+    # the message as searchable text, kept up to date by a database trigger
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+
+    class Meta:
+        indexes = [
+            # serves keyset pagination of a chat's messages
+            models.Index(
+                fields=["chat", "created_date", "id"],
+                name="chat_message_keyset_index"),
+            GinIndex(
+                fields=["search_vector"],
+                name="chat_message_search_index"),
+        ]
+
     def __str__(self):
         return f"\"{self.author}\" made message in \"{self.chat}\""
 
@@ -123,20 +217,102 @@ class ChatMessage(models.Model):
     def get_html_id(self) -> str:
         return "message_" + str(self.pk)
 
+    def attachment_is_image(self) -> bool:
+        return bool(self.attachment) and \
+            Path(self.attachment.name).suffix.lower() in self.IMAGE_ATTACHMENT_SUFFIXES
+
+    def render_message_html(self) -> str:
+        return urlize(self.message, nofollow=True, autoescape=True)
+
+    def get_message_html(self) -> str:
+        # messages saved before message_html existed may not be rendered yet
+        return mark_safe(self.message_html or self.render_message_html())
+
     def get_absolute_url(self):
+        # ask the chat to show this message, which may not be among the newest
         return reverse("chat", kwargs={
-                       "pk": self.chat.pk}) + "#" + self.get_html_id()
-
-    def clean(self) -> None:
-        furfolio_validators.validate_chat_message_author_is_participant(self)
-        return super().clean()
+                       "pk": self.chat_id}) + f"?message={self.pk}#" + self.get_html_id()
 
     def save(self, *args, **kwargs):
+        self.message_html = self.render_message_html()
         # if message is new, notify all recipients
         if not self.pk:
-            save_return = super().save(*args, **kwargs)
-            notification_queries.create_message_notifications_for_recipients(
-                self)
+            # the message and its notifications are saved together, and
+            # streams only hear of the message once both are committed
+            with transaction.atomic(savepoint=False):
+                save_return = super().save(*args, **kwargs)
+                # updating the summary locks the chat until commit, so
+                # messages sent at the same time notify one after the other
+                chat_queries.record_chat_message(self)
+                notification_queries.create_message_notifications_for_recipients(
+                    self)
+                transaction.on_commit(
+                    lambda: chat_queries.publish_chat_message(self))
             return save_return
         else:
             return super().save(*args, **kwargs)
+
+
+class ChatSummary(models.Model):
+    """
+    The latest activity of a chat, kept up to date as messages are sent so
+    that listing chats does not look through their messages.
+    """
+    PREVIEW_MAX_LENGTH = 100
+
+    chat = models.OneToOneField(
+        Chat,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    # only the pk of the last message is used, since the message may be
+    # archived
+    last_message = models.ForeignKey(
+        ChatMessage,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_message_author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_message_preview = models.CharField(
+        max_length=PREVIEW_MAX_LENGTH,
+        blank=True,
+    )
+    last_message_date = models.DateTimeField(
+        null=True,
+        blank=True,
+    )
+    message_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Summary of chat \"{self.chat}\""
+
+
+class ChatArchive(models.Model):
+    """
+    Marks a chat whose messages were moved out of the messages table into
+    gzipped JSON lines, with one message per line.
+    The chat is restored from them when it is opened again.
+    """
+    chat = models.OneToOneField(
+        Chat,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    # kept in the database rather than media storage, since media files are
+    # public and chats are private
+    messages_data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+
+    created_date = models.DateTimeField(name="created_date", auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of chat \"{self.chat}\""
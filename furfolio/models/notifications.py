@@ -1,22 +1,49 @@
-from django.db import models
+from model_utils import FieldTracker
+from django.db import models, transaction
 from django.conf import settings
 from django.urls import reverse
 from .offers import Offer
-from .chat import ChatMessage
+from .chat import Chat, ChatMessage
 from .commissions import Commission
 from .support import SupportTicket
 from .. import mixins
+from ..queries import notifications as notification_queries
 
 """
 When creating a notification sub-model,
-add a receiver that deletes the parent model object
-when its child is deleted.
+add its table to the triggers that delete the parent model object
+when its child is deleted, in a migration like
+0107_notification_delete_triggers.
 
 Also add a test case to confirm the parent is deleted.
 """
 
 
 class Notification(mixins.GetFullUrlMixin, models.Model):
+    KIND_CHAT_MESSAGE = "CHAT_MESSAGE"
+    KIND_OFFER_POSTED = "OFFER_POSTED"
+    KIND_COMMISSION_STATE = "COMMISSION_STATE"
+    KIND_COMMISSION_CREATED = "COMMISSION_CREATED"
+    KIND_USER_FOLLOWED = "USER_FOLLOWED"
+    KIND_SUPPORT_TICKET_STATE = "SUPPORT_TICKET_STATE"
+    KIND_CHOICES = [
+        (KIND_CHAT_MESSAGE, "Chat Message"),
+        (KIND_OFFER_POSTED, "Offer Posted"),
+        (KIND_COMMISSION_STATE, "Commission State"),
+        (KIND_COMMISSION_CREATED, "Commission Created"),
+        (KIND_USER_FOLLOWED, "User Followed"),
+        (KIND_SUPPORT_TICKET_STATE, "Support Ticket State"),
+    ]
+    # the user field that must be true for a user to get notifications of a
+    # kind. kinds without one are always sent
+    KIND_PREFERENCE_FIELDS = {
+        KIND_CHAT_MESSAGE: "notify_of_chat_messages",
+        KIND_OFFER_POSTED: "notify_of_new_offers",
+        KIND_COMMISSION_STATE: "notify_of_commission_changes",
+        KIND_COMMISSION_CREATED: "notify_of_commission_changes",
+        KIND_USER_FOLLOWED: "notify_of_followers",
+    }
+
     recipient = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -24,12 +51,56 @@ class Notification(mixins.GetFullUrlMixin, models.Model):
     seen = models.BooleanField(
         default=False,
     )
+    # which subtype this notification has
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+    )
+    # the ids of what the notification is about, and what happened then,
+    # like the new state of a commission, so listing notifications does not
+    # load their subtypes. the keys depend on the kind. names and urls are
+    # looked up from the ids when the notification is shown, see
+    # notification_queries.resolve_notification_details
+    payload = models.JSONField(
+        default=dict,
+        blank=True,
+    )
 
     created_date = models.DateTimeField(name="created_date", auto_now_add=True)
 
+    tracker = FieldTracker(fields=["seen"])
+
+    class Meta:
+        indexes = [
+            # serves looking up the unseen notifications of a user
+            models.Index(
+                fields=["recipient"],
+                condition=models.Q(seen=False),
+                name="notification_unseen_index"),
+            # serves purging old seen notifications
+            models.Index(
+                fields=["created_date"],
+                condition=models.Q(seen=True),
+                name="notification_seen_date_index"),
+        ]
+
     def __str__(self):
         return f"\"{self.recipient}\" has a notification"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            unread_change = 0 if self.seen else 1
+        elif self.tracker.has_changed("seen"):
+            unread_change = -1 if self.seen else 1
+        else:
+            unread_change = 0
+        with transaction.atomic(savepoint=False):
+            save_return = super().save(*args, **kwargs)
+            if unread_change:
+                notification_queries.change_num_unread_notifications_for_users(
+                    [self.recipient_id], unread_change)
+        return save_return
+
     def get_absolute_url(self):
         return reverse("open_notification", kwargs={"pk": self.pk})
 
@@ -38,32 +109,54 @@ class Notification(mixins.GetFullUrlMixin, models.Model):
         Returns the url that this notification points to.
         This url points to the content it is representing.
         This url does not "open" the notification.
+        It is built from the ids in the payload, so it follows renames.
         """
-        if hasattr(self, "chatmessagenotification"):
-            return self.chatmessagenotification.message.get_absolute_url()
-        elif hasattr(self, "offerpostednotification"):
-            return self.offerpostednotification.offer.get_absolute_url()
-        elif hasattr(self, "commissionstatenotification"):
-            return self.commissionstatenotification.commission.get_absolute_url()
-        elif hasattr(self, "commissioncreatednotification"):
-            return self.commissioncreatednotification.commission.get_absolute_url()
-        elif hasattr(self, "userfollowednotification"):
-            return self.userfollowednotification.follower.get_absolute_url()
-        elif hasattr(self, "supportticketstatenotification"):
-            return self.supportticketstatenotification.support_ticket.get_absolute_url()
-        else:
-            return None
+        payload = self.payload
+        match self.kind:
+            case self.KIND_CHAT_MESSAGE:
+                return ChatMessage(
+                    pk=payload["message"],
+                    chat_id=payload["chat"],
+                ).get_absolute_url()
+            case self.KIND_OFFER_POSTED:
+                return Offer(pk=payload["offer"]).get_absolute_url()
+            case self.KIND_COMMISSION_STATE | self.KIND_COMMISSION_CREATED:
+                return Commission(pk=payload["commission"]).get_absolute_url()
+            case self.KIND_USER_FOLLOWED:
+                # the user url has the username, which the payload does not,
+                # so notification_queries.get_notification_by_pk loads the
+                # follower along with the notification
+                return self.userfollowednotification.follower.get_absolute_url()
+            case self.KIND_SUPPORT_TICKET_STATE:
+                return SupportTicket(
+                    pk=payload["support_ticket"]).get_absolute_url()
+            case _:
+                return None
 
 
 class ChatMessageNotification(models.Model):
+    """
+    Notifies of the messages in a chat that were sent since the recipient last
+    saw its notification. While the notification is unseen, new messages of
+    the chat update it in place instead of adding notifications.
+    """
     notification = models.OneToOneField(
         Notification,
         on_delete=models.CASCADE,
     )
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+    )
+    # the first message the recipient has not seen, which the notification
+    # links to, so the chat shows it and every message after it
     message = models.ForeignKey(
         ChatMessage,
         on_delete=models.CASCADE,
     )
+    message_count = models.PositiveIntegerField(
+        default=1,
+    )
 
     def __str__(self):
         return f"\"{self.notification.recipient}\" has a chat message notification"
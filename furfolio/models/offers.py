@@ -2,6 +2,7 @@ from model_utils import FieldTracker
 from django.db import models
 from django.conf import settings
 from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
 from django.urls import reverse
 from django.utils import timezone
@@ -14,7 +15,6 @@ from .. import validators as furfolio_validators
 from .. import mixins
 from ..queries import commissions as commission_queries
 from ..queries import offers as offer_queries
-from ..queries import notifications as notification_queries
 
 
 # limit offer description to about 1000 words
@@ -192,6 +192,25 @@ class Offer(mixins.CleaningMixin, mixins.GetFullUrlMixin, models.Model):
         ],
     )
 
+    # followers are notified of a new offer by the notify_offer_followers
+    # command, in chunks of followers ordered by pk. these remember where it
+    # is, so it can resume after a failure without notifying anyone twice
+    followers_notification_pending = models.BooleanField(
+        default=False,
+        editable=False,
+    )
+    last_notified_follower_id = models.PositiveBigIntegerField(
+        default=0,
+        editable=False,
+    )
+
+    # the words of the name and description, kept up to date by a database
+    # trigger, so searching offers can use an index
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+
     tracker = FieldTracker()
 
     created_date = models.DateTimeField(name="created_date", auto_now_add=True)
@@ -199,8 +218,13 @@ class Offer(mixins.CleaningMixin, mixins.GetFullUrlMixin, models.Model):
 
     class Meta:
         indexes = [
-            GinIndex(fields=["name", "description"],
-                     fastupdate=False, name="offer_name_description_index"),
+            GinIndex(fields=["search_vector"],
+                     fastupdate=False, name="offer_search_index"),
+            # serves finding offers whose followers are still to be notified
+            models.Index(
+                fields=["id"],
+                condition=models.Q(followers_notification_pending=True),
+                name="offer_followers_pending_index"),
         ]
 
     def __str__(self):
@@ -214,13 +238,11 @@ class Offer(mixins.CleaningMixin, mixins.GetFullUrlMixin, models.Model):
                 Offer.THUMBNAIL_MAX_DIMENSIONS[0],
                 Offer.THUMBNAIL_MAX_DIMENSIONS[1])
 
-        # determine who to notify if offer is created
+        # followers of the author are notified of a new offer in the
+        # background, so a popular author does not wait on the notifications
         if self.tracker.previous("id") is None:
-            super(Offer, self).save(*args, **kwargs)
-            notification_queries.create_offer_posted_notifications_for_followers(
-                self)
-        else:
-            super(Offer, self).save(*args, **kwargs)
+            self.followers_notification_pending = True
+        super(Offer, self).save(*args, **kwargs)
 
     def clean(self):
         super().clean()
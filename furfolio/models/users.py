@@ -27,6 +27,10 @@ class User(mixins.GetFullUrlMixin, AbstractUser):
         (ROLE_CREATOR, "Creator"),
     ]
     AVATAR_SIZE_PIXELS = (64, 64)
+    SEPARATELY_UPDATED_FIELDS = [
+        "unread_notification_count",
+        "last_digest_date",
+    ]
 
     username = models.CharField(
         max_length=MAX_USERNAME_LENGTH,
@@ -70,6 +74,41 @@ class User(mixins.GetFullUrlMixin, AbstractUser):
         help_text="This will display on you profile page. Use this to describe yourself."
     )
 
+    # kept up to date as notifications are created, seen and deleted, so the
+    # notification badge does not count notifications
+    unread_notification_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+    )
+    notify_of_chat_messages = models.BooleanField(
+        verbose_name="Notify me of chat messages",
+        default=True,
+    )
+    notify_of_new_offers = models.BooleanField(
+        verbose_name="Notify me of new offers by users I follow",
+        default=True,
+    )
+    notify_of_commission_changes = models.BooleanField(
+        verbose_name="Notify me of new commissions and commission state changes",
+        default=True,
+    )
+    notify_of_followers = models.BooleanField(
+        verbose_name="Notify me when someone follows me",
+        default=True,
+    )
+    email_notification_digest = models.BooleanField(
+        verbose_name="Email me a digest of unread notifications",
+        help_text="Periodically receive an email listing the notifications you have not seen yet.",
+        default=False,
+    )
+    # when the newest notification that was included in a digest was
+    # created, so the next digest only lists notifications created, or
+    # updated by a newer chat message, after it
+    last_digest_date = models.DateTimeField(
+        null=True,
+        editable=False,
+    )
+
     updated_date = models.DateTimeField(name="updated_date", auto_now=True)
 
     tracker = FieldTracker()
@@ -88,6 +127,15 @@ class User(mixins.GetFullUrlMixin, AbstractUser):
                 User.AVATAR_SIZE_PIXELS[1],
                 transparency_remove=True,
                 fit_in_center=True)
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # the unread notification count and the digest watermark change
+            # by their own UPDATEs, so saving this copy of the user must not
+            # overwrite them
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in User.SEPARATELY_UPDATED_FIELDS
+            ]
         super(User, self).save(*args, **kwargs)
 
     def get_following_users(self):
@@ -100,7 +148,7 @@ class User(mixins.GetFullUrlMixin, AbstractUser):
         return reverse("user", kwargs={"username": self.username})
 
     def get_num_unread_notifications(self):
-        return notification_queries.get_num_unread_notifications_for_user(self)
+        return self.unread_notification_count
 
     def can_commission_offer(self, offer: 'Offer'):
         if self == offer.author:
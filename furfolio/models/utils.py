@@ -72,5 +72,23 @@ def image_resize(image, width, height, transparency_remove=True,
         image.save(img_filename, file_object)
 
 
+def make_image_preview(image, width, height) -> BytesIO | None:
+    """
+    Returns a JPEG of the image shrunk to fit within width and height, or
+    None if the file is not an image Pillow can read or is too large to
+    decompress safely. As LOAD_TRUNCATED_IMAGES is set, a truncated image
+    still gets a preview, with the missing part left blank.
+    """
+    try:
+        img = Image.open(image)
+        img.thumbnail((width, height))
+        img = remove_transparency(img).convert("RGB")
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=80)
+    except (PIL.UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return None
+    return buffer
+
+
 def seven_days_from_now():
     return timezone.now() + timedelta(days=7)
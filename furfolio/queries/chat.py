@@ -1,10 +1,28 @@
-from typing import Union
+from typing import Iterable, Union
+import datetime
+import gzip
+import json
+from pathlib import Path
+from django.contrib.postgres.search import SearchQuery
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.utils.text import Truncator
 from django.shortcuts import get_object_or_404
-from django.db.models import Manager
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import BooleanField, Manager
+from django.db.models import Count, F, Max, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import RawSQL
 
 
 from .. import models
+from ..models.utils import make_image_preview
+
+
+# the Postgres NOTIFY channel that new chat messages are published on
+CHAT_MESSAGE_CHANNEL = "furfolio_chat_message"
+# how many chat messages are shown at once
+CHAT_MESSAGES_PAGE_SIZE = 30
 
 
 def create_chat_for_commission(commission: 'models.Commission'):
@@ -37,13 +55,163 @@ def create_chat_for_support_ticket(
 
 def get_messages_from_chat(
         chat: 'models.Chat') -> 'Manager[models.ChatMessage]':
-    return models.ChatMessage.objects.filter(chat=chat)
+    return models.ChatMessage.objects.filter(
+        chat=chat,
+    ).select_related("author").order_by("created_date", "pk")
+
+
+def get_message_from_chat(
+        chat: 'models.Chat',
+        pk) -> Union['models.ChatMessage', None]:
+    return models.ChatMessage.objects.filter(chat=chat, pk=pk).first()
+
+
+def _compare_to_message(operator: str, message: 'models.ChatMessage') -> RawSQL:
+    # compare (created_date, id) as a row so that, together with the chat,
+    # Postgres can answer it with one range scan of chat_message_keyset_index
+    table = models.ChatMessage._meta.db_table
+    return RawSQL(
+        f'("{table}"."created_date", "{table}"."id") {operator} (%s, %s)',
+        (message.created_date, message.pk),
+        output_field=BooleanField(),
+    )
+
+
+def get_chat_message_page(
+        chat: 'models.Chat',
+        before: Union['models.ChatMessage', None] = None,
+        page_size: int = CHAT_MESSAGES_PAGE_SIZE,
+) -> tuple[list['models.ChatMessage'], bool]:
+    """Returns a page of messages of a chat, oldest first, and whether there
+    are messages older than the page.
+
+    Without `before`, the page holds the newest messages of the chat.
+    Otherwise, it holds the messages right before `before`.
+    """
+    query = models.ChatMessage.objects.filter(chat=chat)
+    if before is not None:
+        query = query.filter(_compare_to_message("<", before))
+    # fetch one extra message to learn if there are older messages
+    messages = list(
+        query.select_related("author").order_by(
+            "-created_date", "-pk")[:page_size + 1]
+    )
+    has_older_messages = len(messages) > page_size
+    messages = messages[:page_size]
+    messages.reverse()
+    return messages, has_older_messages
+
+
+def get_messages_from_chat_since(
+        chat: 'models.Chat',
+        message: 'models.ChatMessage') -> 'Manager[models.ChatMessage]':
+    """Returns `message` and every newer message of its chat, oldest first."""
+    return get_messages_from_chat(chat).filter(
+        _compare_to_message(">=", message))
+
+
+def has_messages_before(
+        chat: 'models.Chat',
+        message: 'models.ChatMessage') -> bool:
+    return models.ChatMessage.objects.filter(
+        chat=chat,
+    ).filter(_compare_to_message("<", message)).exists()
+
+
+def get_messages_from_chat_after(
+        chat: 'models.Chat',
+        after_pk: int) -> 'Manager[models.ChatMessage]':
+    """Returns the messages of a chat that are newer than the message with
+    primary key `after_pk`, oldest first.
+
+    Message primary keys only ever grow, so a client that remembers the last
+    message it has seen can ask for just the messages it is missing.
+    """
+    return models.ChatMessage.objects.filter(
+        chat=chat,
+        pk__gt=after_pk,
+    ).select_related("author").order_by("pk")
+
+
+def mark_chat_messages_read_for_user(
+        chat: 'models.Chat',
+        user: 'models.User',
+        message_pk: int):
+    """Moves the read cursor of the user in the chat forward to the message
+    with primary key `message_pk`.
+
+    This is a single UPDATE of one row, however many messages it marks read.
+    The cursor never moves backward.
+    """
+    # messages sent after the ones the user was shown are still unread
+    newer_message_count = models.ChatMessage.objects.filter(
+        chat=chat,
+        pk__gt=message_pk,
+    ).exclude(
+        author=user,
+    ).order_by().values("chat").annotate(
+        count=Count("pk"),
+    ).values("count")
+    models.ChatParticipant.objects.filter(
+        chat=chat,
+        participant=user,
+    ).filter(
+        Q(last_read_message__isnull=True) | Q(last_read_message__lt=message_pk)
+    ).update(
+        last_read_message=message_pk,
+        unread_message_count=Coalesce(Subquery(newer_message_count), 0),
+    )
+
+
+def get_num_unread_messages_for_user(
+        chat: 'models.Chat',
+        user: 'models.User') -> int:
+    """Counts the messages of others that are newer than the read cursor of
+    the user in the chat."""
+    read_cursor = models.ChatParticipant.objects.filter(
+        chat=chat,
+        participant=user,
+    ).values("last_read_message")[:1]
+    return models.ChatMessage.objects.filter(
+        chat=chat,
+        pk__gt=Coalesce(Subquery(read_cursor), 0),
+    ).exclude(author=user).count()
 
 
 def get_chat_by_pk(pk) -> 'models.Chat':
     return get_object_or_404(models.Chat, pk=pk)
 
 
+def resolve_concrete_chats(chats: Iterable['models.Chat']):
+    """Loads the subtype of every chat, along with what its name needs,
+    using one query per kind of chat instead of one or more per chat.
+
+    Afterwards, `get_concrete_chat()` and `get_name()` of these chats run no
+    queries.
+    """
+    chats_by_kind: dict[str, list['models.Chat']] = dict()
+    for chat in chats:
+        if type(chat) is models.Chat:
+            chats_by_kind.setdefault(chat.kind, []).append(chat)
+
+    subtypes = [
+        (models.Chat.KIND_COMMISSION,
+         models.Chat.commissionchat,
+         models.CommissionChat.objects.select_related("commission__offer")),
+        (models.Chat.KIND_SUPPORT_TICKET,
+         models.Chat.supportticketchat,
+         models.SupportTicketChat.objects.select_related("support_ticket")),
+    ]
+    for kind, descriptor, query in subtypes:
+        chats_of_kind = chats_by_kind.get(kind, [])
+        if not chats_of_kind:
+            continue
+        concrete_chats = query.in_bulk([chat.pk for chat in chats_of_kind])
+        for chat in chats_of_kind:
+            descriptor.related.set_cached_value(
+                chat, concrete_chats.get(chat.pk))
+
+
 def get_commission_chat_by_commission(
         commission: 'models.Commission') -> Union['models.CommissionChat', None]:
     try:
@@ -74,13 +242,113 @@ def test_user_is_participant_of_chat(
     ).exists()
 
 
+def send_chat_message(message: 'models.ChatMessage') -> 'models.ChatMessage':
+    """Saves a new chat message and notifies the other participants of its
+    chat in one transaction.
+
+    Checking the author, saving the message and notifying its recipients
+    take the same number of queries however many participants the chat has.
+    Streams are told of the message once the transaction commits.
+    """
+    with transaction.atomic():
+        if not test_user_is_participant_of_chat(message.chat, message.author):
+            raise ValidationError(
+                "User is not allowed in chat because they are not a participant."
+            )
+        message.save()
+    return message
+
+
+def search_chat_messages_for_user(
+        user: 'models.User',
+        text_query: str) -> 'Manager[models.ChatMessage]':
+    """Full text searches the messages of the chats the user participates
+    in, newest first."""
+    text_query_cleaned = text_query.strip()
+    if not text_query_cleaned:
+        return models.ChatMessage.objects.none()
+    return models.ChatMessage.objects.filter(
+        chat__in=models.ChatParticipant.objects.filter(
+            participant=user).values("chat"),
+        # the config must match the one of the search vector trigger
+        search_vector=SearchQuery(text_query_cleaned, config="english"),
+    ).select_related("author", "chat").order_by("-created_date", "-pk")
+
+
+def record_chat_message(message: 'models.ChatMessage'):
+    """Updates the summary of the chat and the unread counts of the other
+    participants for a new message, in two queries."""
+    summary = dict(
+        last_message_id=message.pk,
+        last_message_author_id=message.author_id,
+        last_message_preview=Truncator(message.message).chars(
+            models.ChatSummary.PREVIEW_MAX_LENGTH),
+        last_message_date=message.created_date,
+    )
+    updated = models.ChatSummary.objects.filter(chat_id=message.chat_id).update(
+        message_count=F("message_count") + 1,
+        **summary,
+    )
+    if not updated:
+        # chats get a summary when created, but be forgiving
+        models.ChatSummary.objects.create(
+            chat_id=message.chat_id, message_count=1, **summary)
+    models.ChatParticipant.objects.filter(
+        chat_id=message.chat_id,
+    ).exclude(
+        participant_id=message.author_id,
+    ).update(unread_message_count=F("unread_message_count") + 1)
+
+
+def get_chat_inbox_for_user(
+        user: 'models.User') -> 'Manager[models.ChatParticipant]':
+    """Returns the participations of the user in chats along with the
+    summaries of the chats, the most recently active chat first."""
+    return models.ChatParticipant.objects.filter(
+        participant=user,
+    ).select_related(
+        "chat__chatsummary",
+        "chat__chatsummary__last_message_author",
+    ).order_by(
+        F("chat__chatsummary__last_message_date").desc(nulls_last=True),
+        "-pk",
+    )
+
+
+def get_attachment_preview_url(message: 'models.ChatMessage') -> str | None:
+    """Returns the url of the preview of an image attachment, making the
+    preview the first time it is asked for. Returns None if the attachment
+    is not an image."""
+    if message.attachment_preview:
+        return message.attachment_preview.url
+    if not message.attachment_is_image():
+        return None
+    with message.attachment.open("rb") as attachment:
+        preview = make_image_preview(
+            attachment,
+            models.ChatMessage.ATTACHMENT_PREVIEW_SIZE,
+            models.ChatMessage.ATTACHMENT_PREVIEW_SIZE,
+        )
+    if preview is None:
+        return None
+    # name the preview after its attachment, so each attachment has one
+    message.attachment_preview.save(
+        f"{message.pk}_{Path(message.attachment.name).stem}.jpg",
+        ContentFile(preview.getvalue()),
+        save=False,
+    )
+    models.ChatMessage.objects.filter(pk=message.pk).update(
+        attachment_preview=message.attachment_preview.name)
+    return message.attachment_preview.url
+
+
 def get_recipients_of_message(
         message: 'models.ChatMessage') -> 'Manager[models.User]':
     # the message author is never a "recipient" of their own message
     return models.User.objects.filter(
         chatparticipant__chat=message.chat
     ).exclude(
-        pk=message.author.pk
+        pk=message.author_id
     )
 
 
@@ -88,3 +356,119 @@ def get_chat_participants(chat: 'models.Chat') -> 'Manager[models.User]':
     return models.User.objects.filter(
         chatparticipant__chat=chat,
     ).order_by("username").distinct()
+
+
+def publish_chat_message(message: 'models.ChatMessage'):
+    """Publishes a new chat message to every process listening on
+    CHAT_MESSAGE_CHANNEL.
+
+    Postgres only delivers the notification once the surrounding transaction
+    commits, so listeners never hear about a message they cannot read yet.
+    """
+    payload = json.dumps({"chat": message.chat_id, "message": message.pk})
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, %s)",
+            [CHAT_MESSAGE_CHANNEL, payload],
+        )
+
+
+def get_chats_to_archive(
+        inactive_since: datetime.datetime) -> 'Manager[models.Chat]':
+    """Returns the chats of finished or rejected commissions that have not
+    had a message since `inactive_since` and are not archived yet."""
+    return models.Chat.objects.filter(
+        kind=models.Chat.KIND_COMMISSION,
+        commissionchat__commission__state__in=[
+            models.Commission.STATE_CLOSED,
+            models.Commission.STATE_REJECTED,
+        ],
+        chatarchive__isnull=True,
+    ).annotate(
+        last_message_date=Max("chatmessage__created_date"),
+    ).filter(last_message_date__lt=inactive_since)
+
+
+def _get_archived_message_fields() -> dict:
+    # the search vector is rebuilt by its trigger when messages are restored
+    return {
+        field.attname: field
+        for field in models.ChatMessage._meta.concrete_fields
+        if field.name != "search_vector"
+    }
+
+
+def archive_chat(chat: 'models.Chat') -> 'models.ChatArchive':
+    """Moves the messages of a chat into gzipped JSON lines stored in its
+    archive, and marks the chat as archived.
+
+    The chat is locked while archiving, which waits for messages being sent
+    to it to commit and holds off new ones, so every message deleted is in
+    the archive.
+    """
+    fields = _get_archived_message_fields()
+    with transaction.atomic():
+        models.Chat.objects.select_for_update().filter(pk=chat.pk).first()
+        lines = []
+        message_pks = []
+        for message in models.ChatMessage.objects.filter(
+                chat=chat).order_by("pk").iterator():
+            lines.append(json.dumps({
+                attname: None if field.value_from_object(message) is None
+                else field.value_to_string(message)
+                for attname, field in fields.items()
+            }))
+            message_pks.append(message.pk)
+
+        archive = models.ChatArchive.objects.create(
+            chat=chat,
+            message_count=len(lines),
+            messages_data=gzip.compress("\n".join(lines).encode()),
+        )
+        models.ChatMessage.objects.filter(pk__in=message_pks).delete()
+    return archive
+
+
+def restore_archived_chat(chat: 'models.Chat') -> bool:
+    """Moves the messages of an archived chat back into the database.
+    Returns whether this call restored the chat.
+
+    The archive is locked while restoring, so when two requests open the
+    same archived chat, the second one waits and then finds nothing left to
+    restore, instead of inserting the messages again.
+    """
+    # most chats are not archived, so check before taking a lock
+    if not models.ChatArchive.objects.filter(chat=chat).exists():
+        return False
+
+    fields = _get_archived_message_fields()
+    with transaction.atomic():
+        archive = models.ChatArchive.objects.select_for_update().filter(
+            chat=chat).first()
+        if archive is None:
+            # restored by another request meanwhile
+            return False
+
+        lines = gzip.decompress(
+            bytes(archive.messages_data)).decode().splitlines()
+        messages = []
+        for line in lines:
+            messages.append(models.ChatMessage(**{
+                attname: None if value is None else fields[attname].to_python(value)
+                for attname, value in json.loads(line).items()
+                if attname in fields
+            }))
+        dates = [(message.created_date, message.updated_date)
+                 for message in messages]
+
+        models.ChatMessage.objects.bulk_create(messages)
+        # bulk_create stamps the dates with the current time, so put back
+        # the original ones
+        for message, (created_date, updated_date) in zip(messages, dates):
+            message.created_date = created_date
+            message.updated_date = updated_date
+        models.ChatMessage.objects.bulk_update(
+            messages, ["created_date", "updated_date"], batch_size=500)
+        archive.delete()
+    return True
+
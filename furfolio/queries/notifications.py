@@ -1,27 +1,164 @@
-from django.db.models import Manager
+import datetime
+from django.db import connection, transaction
+from django.db.models import Count, F, Manager, OuterRef, Q, QuerySet, Subquery, Value, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from . import chat as chat_queries
 from . import offers as offer_queries
 from .. import models
 
 
-def create_message_notification(
-        message: 'models.ChatMessage',
-        recipient: 'models.User') -> 'models.ChatMessageNotification':
-    notification = models.Notification.objects.create(
-        recipient=recipient,
-    )
-    message_notification = models.ChatMessageNotification.objects.create(
-        notification=notification,
-        message=message,
-    )
-    return message_notification
+# how many notifications create_notifications inserts per statement
+NOTIFICATION_BATCH_SIZE = 1000
+# how many followers notify_offer_followers_chunk notifies at once
+OFFER_FOLLOWERS_CHUNK_SIZE = 1000
+# how many notifications make_all_notifications_seen_for_user updates at once
+MARK_ALL_SEEN_CHUNK_SIZE = 1000
+# how many notifications purge_seen_notifications deletes at once
+PURGE_CHUNK_SIZE = 1000
+# how many users get_notification_digests builds digests for at once
+DIGEST_CHUNK_SIZE = 500
+# how many notifications a digest lists, the rest are only counted
+DIGEST_MAX_NOTIFICATIONS = 20
+
+
+def filter_recipients_wanting_kind(recipients: QuerySet, kind: str) -> QuerySet:
+    """Filters the users to those whose notification preferences allow
+    notifications of the kind."""
+    preference_field = models.Notification.KIND_PREFERENCE_FIELDS.get(kind)
+    if preference_field:
+        recipients = recipients.filter(**{preference_field: True})
+    return recipients
+
+
+def create_notifications(
+        recipients,
+        kind: str,
+        payload: dict,
+        subtype_model: type,
+        **subtype_fields) -> int:
+    """Notifies every recipient of the same thing and returns how many
+    notifications were created.
+
+    Recipients who turned off notifications of this kind are left out by the
+    query for the recipients. Then each batch of NOTIFICATION_BATCH_SIZE
+    recipients takes three statements, however large the batch is: one
+    inserting the notifications, one inserting their rows of `subtype_model`
+    with `subtype_fields`, and one raising the unread counts of the
+    recipients.
+
+    Args:
+        recipients: a queryset or list of users or user pks
+        kind: the kind of the notifications, like Notification.KIND_OFFER_POSTED
+        payload: what the notifications show
+        subtype_model: the subtype of the notifications, like OfferPostedNotification
+    """
+    if not isinstance(recipients, QuerySet):
+        recipients = [getattr(recipient, "pk", recipient)
+                      for recipient in recipients]
+        if not recipients:
+            return 0
+        recipients = models.User.objects.filter(pk__in=recipients)
+    recipients = filter_recipients_wanting_kind(recipients, kind)
+    recipient_pks = list(recipients.values_list("pk", flat=True))
+    with transaction.atomic(savepoint=False):
+        for start in range(0, len(recipient_pks), NOTIFICATION_BATCH_SIZE):
+            batch_pks = recipient_pks[start:start + NOTIFICATION_BATCH_SIZE]
+            notifications = models.Notification.objects.bulk_create(
+                models.Notification(
+                    recipient_id=recipient_pk,
+                    kind=kind,
+                    payload=payload,
+                )
+                for recipient_pk in batch_pks
+            )
+            subtype_model.objects.bulk_create(
+                subtype_model(notification=notification, **subtype_fields)
+                for notification in notifications
+            )
+            change_num_unread_notifications_for_users(batch_pks, 1)
+    return len(recipient_pks)
+
+
+def get_message_notification_payload(
+        message: 'models.ChatMessage', message_count: int = 1) -> dict:
+    return {
+        "chat": message.chat_id,
+        "message": message.pk,
+        "author": message.author_id,
+        "message_count": message_count,
+    }
+
+
+def coalesce_message_notifications(
+        message: 'models.ChatMessage', recipient_pks) -> set[int]:
+    """Counts the message in the unseen notifications of its chat that the
+    recipients already have, in one statement, and returns the pks of those
+    recipients.
+
+    The notifications keep pointing to the first message the recipient has
+    not seen, so opening them shows every message they count. They take the
+    author of the message and move to the top of the notification list.
+    """
+    if not recipient_pks:
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH coalesced AS (
+                UPDATE {models.ChatMessageNotification._meta.db_table} AS message_notification
+                SET message_count = message_notification.message_count + 1
+                FROM {models.Notification._meta.db_table} AS notification
+                WHERE notification.id = message_notification.notification_id
+                    AND message_notification.chat_id = %s
+                    AND NOT notification.seen
+                    AND notification.recipient_id = ANY(%s)
+                RETURNING message_notification.notification_id,
+                    message_notification.message_count
+            )
+            UPDATE {models.Notification._meta.db_table} AS notification
+            SET payload = notification.payload || jsonb_build_object(
+                    'author', %s,
+                    'message_count', coalesced.message_count),
+                created_date = %s
+            FROM coalesced
+            WHERE notification.id = coalesced.notification_id
+            RETURNING notification.recipient_id
+            """,
+            [message.chat_id, list(recipient_pks),
+             message.author_id, timezone.now()],
+        )
+        return {recipient_pk for recipient_pk, in cursor.fetchall()}
 
 
 def create_message_notifications_for_recipients(message: 'models.ChatMessage'):
-    for recipient in chat_queries.get_recipients_of_message(message):
-        create_message_notification(message, recipient)
+    """Notifies the recipients of a message in at most six queries, however
+    many recipients there are.
+
+    Recipients with an unseen notification of the chat have the message
+    counted in it. The others get a new notification. The caller should have
+    locked the chat for new messages, as ChatMessage.save does, so two
+    messages do not both create notifications.
+    """
+    # recipients who turned chat message notifications off keep their
+    # unseen notification as it is, as they would get no new one
+    recipient_pks = list(filter_recipients_wanting_kind(
+        chat_queries.get_recipients_of_message(message),
+        models.Notification.KIND_CHAT_MESSAGE,
+    ).values_list("pk", flat=True))
+    coalesced_recipient_pks = coalesce_message_notifications(
+        message, recipient_pks)
+    create_notifications(
+        [recipient_pk for recipient_pk in recipient_pks
+         if recipient_pk not in coalesced_recipient_pks],
+        models.Notification.KIND_CHAT_MESSAGE,
+        get_message_notification_payload(message),
+        models.ChatMessageNotification,
+        chat_id=message.chat_id,
+        message=message,
+    )
 
 
 def make_chat_message_notifications_seen_for_user_and_chat(
@@ -30,108 +167,203 @@ def make_chat_message_notifications_seen_for_user_and_chat(
 ):
     """given a user and a chat they are in, make all message notifications seen.
 
+    Chats call this whenever they show messages, and usually there is nothing
+    to clear, so that case costs one existence check. Otherwise, all of the
+    notifications are made seen in one UPDATE, and the unread count of the
+    user goes down in another.
+
     Args:
-        chat (models.Chat): _description_
-        user (models.User): _description_
+        chat (models.Chat): the chat whose message notifications to make seen
+        user (models.User): the recipient of the notifications
     """
-    unread_message_notifications_for_user_in_chat = models.ChatMessageNotification.objects.filter(
-        message__chat=chat, notification__recipient=user, notification__seen=False, )
-    for message_notification in unread_message_notifications_for_user_in_chat:
-        message_notification.notification.seen = True
-        message_notification.notification.full_clean()
-        message_notification.notification.save()
-
-
-def create_offer_posted_notification(
-        offer: 'models.Offer',
-        recipient: 'models.User') -> 'models.OfferPostedNotification':
-    notification = models.Notification.objects.create(
-        recipient=recipient,
+    unseen_notifications = models.Notification.objects.filter(
+        recipient=user,
+        seen=False,
+        chatmessagenotification__chat=chat,
     )
-    offer_posted_notification = models.OfferPostedNotification.objects.create(
-        notification=notification,
+    if unseen_notifications.exists():
+        with transaction.atomic(savepoint=False):
+            num_seen = unseen_notifications.update(seen=True)
+            change_num_unread_notifications_for_users([user.pk], -num_seen)
+
+
+def get_offer_posted_notification_payload(offer: 'models.Offer') -> dict:
+    return {
+        "offer": offer.pk,
+        "author": offer.author_id,
+    }
+
+
+def create_offer_posted_notifications(offer: 'models.Offer', recipients) -> int:
+    return create_notifications(
+        recipients,
+        models.Notification.KIND_OFFER_POSTED,
+        get_offer_posted_notification_payload(offer),
+        models.OfferPostedNotification,
         offer=offer,
     )
-    return offer_posted_notification
 
 
-def create_offer_posted_notifications_for_followers(offer: 'models.Offer'):
-    users_to_notify = offer_queries.get_who_to_notify_for_new_offer(offer)
-    for user in users_to_notify:
-        create_offer_posted_notification(offer, user)
+def notify_offer_followers_chunk(offer_pk: int) -> bool | None:
+    """Notifies the next OFFER_FOLLOWERS_CHUNK_SIZE followers of the author of
+    a new offer, and returns whether there are followers left to notify.
 
-
-def create_commission_state_notification(
-        commission: 'models.Commission',
-        recipient: 'models.User') -> 'models.CommissionStateNotification':
-    notification = models.Notification.objects.create(
-        recipient=recipient,
+    The notifications and how far the offer got are saved in one transaction,
+    so a failed chunk is retried from where the last one stopped. The offer
+    is locked meanwhile, and skipped if another worker has it locked. Returns
+    None if the offer was skipped, or has no followers left to notify.
+    """
+    with transaction.atomic():
+        offer = models.Offer.objects.select_for_update(
+            skip_locked=True,
+        ).filter(
+            pk=offer_pk,
+            followers_notification_pending=True,
+        ).first()
+        if offer is None:
+            return None
+        follower_pks = list(offer_queries.get_who_to_notify_for_new_offer(
+            offer,
+        ).filter(
+            pk__gt=offer.last_notified_follower_id,
+        ).order_by("pk").values_list(
+            "pk", flat=True,
+        )[:OFFER_FOLLOWERS_CHUNK_SIZE])
+        create_offer_posted_notifications(offer, follower_pks)
+        is_pending = len(follower_pks) == OFFER_FOLLOWERS_CHUNK_SIZE
+        models.Offer.objects.filter(pk=offer.pk).update(
+            followers_notification_pending=is_pending,
+            last_notified_follower_id=(
+                follower_pks[-1] if follower_pks
+                else offer.last_notified_follower_id),
+        )
+    return is_pending
+
+
+def notify_pending_offer_followers() -> int:
+    """Notifies the followers of every new offer, a chunk of each offer at a
+    time so one popular author does not hold up the others. Returns how many
+    offers this call finished, not counting those another worker had locked
+    or finished."""
+    num_finished = 0
+    offer_pks = list(models.Offer.objects.filter(
+        followers_notification_pending=True,
+    ).order_by("pk").values_list("pk", flat=True))
+    while offer_pks:
+        pending_offer_pks = list()
+        for offer_pk in offer_pks:
+            is_pending = notify_offer_followers_chunk(offer_pk)
+            if is_pending:
+                pending_offer_pks.append(offer_pk)
+            elif is_pending is not None:
+                num_finished += 1
+        offer_pks = pending_offer_pks
+    return num_finished
+
+
+def get_commission_state_notification_payload(
+        commission: 'models.Commission') -> dict:
+    return {
+        "commission": commission.pk,
+        "offer": commission.offer_id,
+        "state": commission.state,
+    }
+
+
+def create_commission_state_notifications(
+        commission: 'models.Commission', recipients) -> int:
+    return create_notifications(
+        recipients,
+        models.Notification.KIND_COMMISSION_STATE,
+        get_commission_state_notification_payload(commission),
+        models.CommissionStateNotification,
+        commission=commission,
+        state=commission.state,
     )
-    commission_state_notification = models.CommissionStateNotification.objects.create(
-        notification=notification, commission=commission, state=commission.state, )
-    return commission_state_notification
 
 
 def create_commission_state_notification_for_commissioner(
         commission: 'models.Commission'):
-    create_commission_state_notification(commission, commission.commissioner)
-
-
-def create_commission_created_notification(
-        commission: 'models.Commission',
-        recipient: 'models.User') -> 'models.CommissionCreatedNotification':
-    notification = models.Notification.objects.create(
-        recipient=recipient,
+    create_commission_state_notifications(
+        commission, [commission.commissioner_id])
+
+
+def get_commission_created_notification_payload(
+        commission: 'models.Commission') -> dict:
+    return {
+        "commission": commission.pk,
+        "offer": commission.offer_id,
+        "commissioner": commission.commissioner_id,
+    }
+
+
+def create_commission_created_notifications(
+        commission: 'models.Commission', recipients) -> int:
+    return create_notifications(
+        recipients,
+        models.Notification.KIND_COMMISSION_CREATED,
+        get_commission_created_notification_payload(commission),
+        models.CommissionCreatedNotification,
+        commission=commission,
     )
-    commission_created_notification = models.CommissionCreatedNotification.objects.create(
-        notification=notification, commission=commission, )
-    return commission_created_notification
 
 
 def create_commission_created_notification_for_author(
         commission: 'models.Commission'):
-    create_commission_created_notification(commission, commission.offer.author)
+    create_commission_created_notifications(
+        commission, [commission.offer.author_id])
+
+
+def get_user_followed_notification_payload(follower: 'models.User') -> dict:
+    return {
+        "follower": follower.pk,
+    }
 
 
-def create_user_followed_notification(
-        follower: 'models.User',
-        recipient: 'models.User') -> 'models.UserFollowedNotification':
-    notification = models.Notification.objects.create(
-        recipient=recipient,
+def create_user_followed_notifications(
+        follower: 'models.User', recipients) -> int:
+    return create_notifications(
+        recipients,
+        models.Notification.KIND_USER_FOLLOWED,
+        get_user_followed_notification_payload(follower),
+        models.UserFollowedNotification,
+        follower=follower,
     )
-    user_followed_notification = models.UserFollowedNotification.objects.create(
-        notification=notification, follower=follower, )
-    return user_followed_notification
 
 
 def create_user_followed_notification_using_user_following_user(
         user_following_user: 'models.UserFollowingUser'):
-    create_user_followed_notification(
+    create_user_followed_notifications(
         user_following_user.follower,
-        user_following_user.followed)
+        [user_following_user.followed_id])
 
 
-def create_support_ticket_state_notification(
-    support_ticket: 'models.SupportTicket',
-    recipient: 'models.User',
-) -> 'models.SupportTicketStateNotification':
-    notification = models.Notification.objects.create(
-        recipient=recipient,
-    )
-    support_ticket_state_notification = models.SupportTicketStateNotification.objects.create(
-        notification=notification,
+def get_support_ticket_state_notification_payload(
+        support_ticket: 'models.SupportTicket') -> dict:
+    return {
+        "support_ticket": support_ticket.pk,
+        "state": support_ticket.state,
+    }
+
+
+def create_support_ticket_state_notifications(
+        support_ticket: 'models.SupportTicket', recipients) -> int:
+    return create_notifications(
+        recipients,
+        models.Notification.KIND_SUPPORT_TICKET_STATE,
+        get_support_ticket_state_notification_payload(support_ticket),
+        models.SupportTicketStateNotification,
         support_ticket=support_ticket,
         support_ticket_state=support_ticket.state,
     )
-    return support_ticket_state_notification
 
 
 def create_support_ticket_state_notification_for_author(
     support_ticket: 'models.SupportTicket',
 ):
-    create_support_ticket_state_notification(
+    create_support_ticket_state_notifications(
         support_ticket,
-        support_ticket.author,
+        [support_ticket.author_id],
     )
 
 
@@ -146,26 +378,231 @@ def get_notifications_for_user(
     return query
 
 
+def resolve_notification_details(
+        notifications) -> list['models.Notification']:
+    """Sets `details` on each notification to what it shows, like its
+    "author" or "offer_name", looked up from the ids in its payload, so names
+    are current. Returns the notifications as a list.
+
+    Takes one query per kind of thing the notifications refer to, however
+    many notifications there are.
+    """
+    notifications = list(notifications)
+    user_pks, chat_pks, offer_pks, support_ticket_pks = set(), set(), set(), set()
+    for notification in notifications:
+        payload = notification.payload
+        for user_key in ["author", "commissioner", "follower"]:
+            if payload.get(user_key) is not None:
+                user_pks.add(payload[user_key])
+        if "chat" in payload:
+            chat_pks.add(payload["chat"])
+        if "offer" in payload:
+            offer_pks.add(payload["offer"])
+        if "support_ticket" in payload:
+            support_ticket_pks.add(payload["support_ticket"])
+
+    users = models.User.objects.in_bulk(user_pks)
+    chats = models.Chat.objects.in_bulk(chat_pks)
+    chat_queries.resolve_concrete_chats(chats.values())
+    offers = models.Offer.objects.in_bulk(offer_pks)
+    support_tickets = models.SupportTicket.objects.in_bulk(support_ticket_pks)
+    support_ticket_states = dict(models.SupportTicket.STATE_CHOICES)
+
+    for notification in notifications:
+        payload = notification.payload
+        chat = chats.get(payload.get("chat"))
+        offer = offers.get(payload.get("offer"))
+        support_ticket = support_tickets.get(payload.get("support_ticket"))
+        state = payload.get("state")
+        if notification.kind == models.Notification.KIND_SUPPORT_TICKET_STATE:
+            state = support_ticket_states.get(state, state)
+        notification.details = {
+            "author": users.get(payload.get("author")),
+            "commissioner": users.get(payload.get("commissioner")),
+            "follower": users.get(payload.get("follower")),
+            "chat_name": chat.get_name() if chat else "",
+            "message_count": payload.get("message_count", 1),
+            "offer_name": offer.name if offer else "",
+            "title": support_ticket.title if support_ticket else "",
+            "state": state,
+        }
+    return notifications
+
+
 def get_notification_by_pk(pk) -> 'models.Notification':
-    return get_object_or_404(models.Notification, pk=pk)
+    """Returns the notification, along with what get_content_url needs, so
+    opening it takes no more queries whatever its kind."""
+    return get_object_or_404(
+        models.Notification.objects.select_related(
+            "userfollowednotification__follower"),
+        pk=pk,
+    )
 
 
 def make_notification_seen(notification: 'models.Notification'):
+    """Makes the notification seen and lowers the unread count of its
+    recipient, in one statement. Does nothing if it is already seen."""
+    if notification.seen:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH seen_notification AS (
+                UPDATE {models.Notification._meta.db_table}
+                SET seen = true
+                WHERE id = %s AND NOT seen
+                RETURNING recipient_id
+            )
+            UPDATE {models.User._meta.db_table}
+            SET unread_notification_count = GREATEST(unread_notification_count - 1, 0)
+            WHERE id IN (SELECT recipient_id FROM seen_notification)
+            """,
+            [notification.pk],
+        )
     notification.seen = True
-    notification.full_clean()
-    notification.save()
+    # the count is already lowered, so saving this notification later must
+    # not lower it again
+    notification.tracker.set_saved_fields(fields=["seen"])
 
 
 def make_all_notifications_seen_for_user(user: 'models.User'):
-    unseen_notifications = models.Notification.objects.filter(
-        seen=False,
-        recipient=user,
-    )
-    for notification in unseen_notifications:
-        notification.seen = True
-        notification.full_clean()
-        notification.save()
+    """Makes all notifications of the user seen, a chunk at a time.
+
+    Each chunk is one UPDATE of at most MARK_ALL_SEEN_CHUNK_SIZE
+    notifications, along with the user's unread count, in its own short
+    transaction, so thousands of notifications do not hold one long lock.
+    """
+    while True:
+        with transaction.atomic():
+            chunk = models.Notification.objects.filter(
+                recipient=user,
+                seen=False,
+            ).values("pk")[:MARK_ALL_SEEN_CHUNK_SIZE]
+            num_seen = models.Notification.objects.filter(
+                pk__in=chunk,
+            ).update(seen=True)
+            if num_seen:
+                change_num_unread_notifications_for_users(
+                    [user.pk], -num_seen)
+        if num_seen < MARK_ALL_SEEN_CHUNK_SIZE:
+            return
+
+
+def purge_seen_notifications(seen_before: datetime.datetime) -> int:
+    """Deletes the seen notifications created before `seen_before`, a chunk
+    at a time, and returns how many were deleted.
+
+    Notifications are deleted through the ORM, so their subtype rows go with
+    them.
+    """
+    num_purged = 0
+    while True:
+        chunk = list(models.Notification.objects.filter(
+            seen=True,
+            created_date__lt=seen_before,
+        ).values_list("pk", flat=True)[:PURGE_CHUNK_SIZE])
+        if not chunk:
+            return num_purged
+        with transaction.atomic():
+            models.Notification.objects.filter(pk__in=chunk).delete()
+        num_purged += len(chunk)
+
+
+def get_notification_digests():
+    """Yields the users due an email digest, DIGEST_CHUNK_SIZE at a time.
+
+    A user is due a digest when they opted in and have unread notifications
+    newer than their last digest. Each user gets `digest_notifications`, the
+    newest DIGEST_MAX_NOTIFICATIONS of those notifications with their
+    details resolved, and `num_digest_notifications`, how many there are in
+    total. Each chunk takes a constant number of queries, however many
+    notifications the users have.
+    """
+    last_user_pk = 0
+    while True:
+        users = list(models.User.objects.filter(
+            pk__gt=last_user_pk,
+            is_active=True,
+            email_notification_digest=True,
+            unread_notification_count__gt=0,
+        ).exclude(email="").order_by("pk")[:DIGEST_CHUNK_SIZE])
+        if not users:
+            return
+        last_user_pk = users[-1].pk
+
+        # coalescing a chat message moves the created date of a notification
+        # forward, so the watermark is a date rather than a pk
+        notifications = models.Notification.objects.filter(
+            Q(recipient__last_digest_date__isnull=True)
+            | Q(created_date__gt=F("recipient__last_digest_date")),
+            recipient__in=users,
+            seen=False,
+        ).annotate(
+            digest_position=Window(
+                RowNumber(),
+                partition_by=F("recipient"),
+                order_by=[F("created_date").desc(), F("pk").desc()],
+            ),
+            num_digest_notifications=Window(
+                Count("pk"),
+                partition_by=F("recipient"),
+            ),
+        ).filter(
+            digest_position__lte=DIGEST_MAX_NOTIFICATIONS,
+        ).order_by("recipient", "-created_date", "-pk")
+
+        notifications_by_user = dict()
+        for notification in resolve_notification_details(notifications):
+            notifications_by_user.setdefault(
+                notification.recipient_id, list()).append(notification)
+
+        due_users = list()
+        for user in users:
+            digest_notifications = notifications_by_user.get(user.pk)
+            if not digest_notifications:
+                continue
+            user.digest_notifications = digest_notifications
+            user.num_digest_notifications = \
+                digest_notifications[0].num_digest_notifications
+            due_users.append(user)
+        if due_users:
+            yield due_users
+
+
+def set_notification_digests_sent(users: list['models.User']):
+    """Moves the digest watermark of each user past the notifications of the
+    digest they were sent, in one query, so they are never sent again."""
+    for user in users:
+        user.last_digest_date = user.digest_notifications[0].created_date
+    models.User.objects.bulk_update(users, ["last_digest_date"])
 
 
 def get_num_unread_notifications_for_user(user: 'models.User') -> int:
     return get_notifications_for_user(user).filter(seen=False).count()
+
+
+def change_num_unread_notifications_for_users(user_pks, change: int):
+    """Adds `change` to the unread notification counts of the users, in one
+    UPDATE. Counts never go below zero."""
+    models.User.objects.filter(pk__in=user_pks).update(
+        unread_notification_count=Greatest(
+            F("unread_notification_count") + change, Value(0)),
+    )
+
+
+def repair_num_unread_notifications_for_users() -> int:
+    """Recounts the unread notifications of every user, fixing counters that
+    drifted. Returns how many users had a wrong count."""
+    unread_counts = models.Notification.objects.filter(
+        recipient=OuterRef("pk"),
+        seen=False,
+    ).order_by().values("recipient").annotate(
+        count=Count("pk"),
+    ).values("count")
+    counted = Coalesce(Subquery(unread_counts), 0)
+    return models.User.objects.annotate(
+        counted=counted,
+    ).exclude(
+        unread_notification_count=F("counted"),
+    ).update(unread_notification_count=counted)
+
@@ -1,7 +1,7 @@
 from token import MINUS
 from django.utils import timezone
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
-from django.db.models import Q
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q
 from django.shortcuts import get_object_or_404
 
 from .. import models
@@ -67,11 +67,13 @@ def full_text_search_offers(search_query: OfferSearchQuery):
     text_query_cleaned = search_query.text_query.strip()
     author_cleaned = search_query.author.strip()
     if text_query_cleaned:
-        search_vector = SearchVector(
-            "name", weight="A") + SearchVector("description", weight="A")
-        search_query_db = SearchQuery(text_query_cleaned)
-        search_rank = SearchRank(search_vector, search_query_db)
-        query = query.annotate(rank=search_rank).filter(rank__gte=0.2)
+        # match on the indexed search vector first, so only matching offers
+        # are ranked
+        search_query_db = SearchQuery(text_query_cleaned, config="english")
+        search_rank = SearchRank(F("search_vector"), search_query_db)
+        query = query.filter(
+            search_vector=search_query_db,
+        ).annotate(rank=search_rank).filter(rank__gte=0.2)
     if author_cleaned:
         query = query.filter(author__username=author_cleaned)
     if not search_query.closed_offers:
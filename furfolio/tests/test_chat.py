@@ -1,12 +1,26 @@
-from django.test import TestCase
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.core.management import call_command
 from ..models import Commission, User, Offer
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
 from . import utils
 from .. import utils as furfolio_utils
 from .. import models
+from ..models.utils import make_image_preview
+from .. import chat_listener
 from ..queries import commissions as commission_queries
+from ..queries import chat as chat_queries
+from ..views import chat as chat_views
+import asyncio
 import datetime
+import io
+from PIL import Image
 
 
 class ChatParticipantCanMessageTestCase(TestCase):
@@ -43,3 +57,539 @@ class ChatMessageNotificationTestCase(TestCase):
             [self.user2.pk, self.user3.pk],
             transform=lambda message_noti: message_noti.notification.recipient.pk
         )
+
+
+class ChatMessagesAfterCursorTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        for user in [self.user1, self.user2]:
+            utils.add_chat_participant(self.chat, user)
+        self.message1 = utils.make_chat_message(self.chat, self.user1)
+        self.message2 = utils.make_chat_message(self.chat, self.user2)
+
+    def test_get_messages_after_cursor(self):
+        self.assertQuerySetEqual(
+            chat_queries.get_messages_from_chat_after(
+                self.chat, self.message1.pk),
+            [self.message2.pk],
+            transform=lambda message: message.pk,
+        )
+
+    def test_component_returns_only_new_messages(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(
+            reverse("chat_messages_component", kwargs={"pk": self.chat.pk}),
+            {"after": self.message1.pk},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, self.message1.get_html_id())
+        self.assertContains(response, self.message2.get_html_id())
+
+    def test_component_returns_no_content_when_up_to_date(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(
+            reverse("chat_messages_component", kwargs={"pk": self.chat.pk}),
+            {"after": self.message2.pk},
+        )
+        self.assertEqual(response.status_code, 204)
+
+
+class ChatMessageListenerTestCase(TestCase):
+    def setUp(self):
+        self.listener = chat_listener.ChatMessageListener()
+
+    async def test_dispatch_reaches_subscribers_of_chat(self):
+        with mock.patch.object(self.listener, "_start"):
+            queue = self.listener.subscribe(1)
+            other_chat_queue = self.listener.subscribe(2)
+        self.listener.dispatch('{"chat": 1, "message": 5}')
+        self.assertEqual(await asyncio.wait_for(queue.get(), timeout=1), 5)
+        self.assertTrue(other_chat_queue.empty())
+
+    async def test_unsubscribed_queue_is_not_reached(self):
+        with mock.patch.object(self.listener, "_start"):
+            queue = self.listener.subscribe(1)
+        self.listener.unsubscribe(1, queue)
+        self.listener.dispatch('{"chat": 1, "message": 5}')
+        await asyncio.sleep(0)
+        self.assertTrue(queue.empty())
+
+
+class ChatMessageStreamTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.user1)
+
+    def test_non_participant_cannot_stream(self):
+        self.client.force_login(self.user2)
+        response = self.client.get(
+            reverse("chat_message_stream", kwargs={"pk": self.chat.pk}))
+        self.assertEqual(response.status_code, 403)
+
+
+class ChatMessageStreamConnectionTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.user1)
+        self.message = utils.make_chat_message(self.chat, self.user1)
+
+    def count_database_connections(self) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database()")
+            return cursor.fetchone()[0]
+
+    @mock.patch.object(chat_views.ChatMessageStream, "KEEP_ALIVE_SECONDS", 0.1)
+    async def test_waiting_stream_holds_no_connection(self):
+        count_database_connections = sync_to_async(
+            self.count_database_connections)
+        num_connections = await count_database_connections()
+        request = RequestFactory().get("/")
+        request.user = self.user1
+        with mock.patch.object(chat_listener.listener, "_start"):
+            stream = chat_views.ChatMessageStream().stream(
+                request, self.chat, 0)
+            self.assertIn(f"id: {self.message.pk}\n", await anext(stream))
+            # the stream is now waiting for new messages
+            self.assertEqual(await anext(stream), ": keep-alive\n\n")
+            self.assertEqual(
+                await count_database_connections(), num_connections)
+            await stream.aclose()
+
+
+class ChatMessagePageTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.user1)
+        self.messages = [
+            utils.make_chat_message(self.chat, self.user1, f"Message {i}")
+            for i in range(5)
+        ]
+
+    def test_newest_page(self):
+        messages, has_older_messages = chat_queries.get_chat_message_page(
+            self.chat, page_size=2)
+        self.assertEqual(messages, self.messages[3:])
+        self.assertTrue(has_older_messages)
+
+    def test_pages_before_message(self):
+        messages, has_older_messages = chat_queries.get_chat_message_page(
+            self.chat, before=self.messages[3], page_size=2)
+        self.assertEqual(messages, self.messages[1:3])
+        self.assertTrue(has_older_messages)
+
+        messages, has_older_messages = chat_queries.get_chat_message_page(
+            self.chat, before=self.messages[1], page_size=2)
+        self.assertEqual(messages, self.messages[:1])
+        self.assertFalse(has_older_messages)
+
+    def test_messages_since_message(self):
+        self.assertEqual(
+            list(chat_queries.get_messages_from_chat_since(
+                self.chat, self.messages[2])),
+            self.messages[2:],
+        )
+
+
+class ChatKindTestCase(TestCase):
+    def setUp(self):
+        self.creator = utils.make_user(
+            "creator", role=models.User.ROLE_CREATOR)
+        self.buyer = utils.make_user("buyer")
+        self.offer = utils.make_offer(self.creator, name="Sketch Offer")
+        self.commission = utils.make_commission(self.buyer, self.offer)
+        chat_queries.create_chat_for_commission(self.commission)
+        self.support_ticket = utils.make_support_ticket(
+            self.buyer, title="Ticket Title")
+        chat_queries.create_chat_for_support_ticket(
+            self.support_ticket, self.creator)
+        self.generic_chat = utils.make_chat()
+
+    def test_chats_store_their_kind(self):
+        self.assertEqual(
+            models.CommissionChat.objects.get().kind,
+            models.Chat.KIND_COMMISSION)
+        self.assertEqual(
+            models.SupportTicketChat.objects.get().kind,
+            models.Chat.KIND_SUPPORT_TICKET)
+        self.assertEqual(self.generic_chat.kind, models.Chat.KIND_GENERIC)
+
+    def test_resolve_concrete_chats_loads_names_in_constant_queries(self):
+        chats = list(models.Chat.objects.order_by("pk"))
+        with self.assertNumQueries(2):
+            chat_queries.resolve_concrete_chats(chats)
+        with self.assertNumQueries(0):
+            names = [chat.get_name() for chat in chats]
+        self.assertEqual(names, ["Sketch Offer", "Ticket Title", "Generic Chat"])
+
+
+class ChatReadCursorTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        for user in [self.user1, self.user2]:
+            utils.add_chat_participant(self.chat, user)
+        self.messages = [
+            utils.make_chat_message(self.chat, self.user1, f"Message {i}")
+            for i in range(3)
+        ]
+
+    def test_messages_of_others_are_unread(self):
+        self.assertEqual(
+            chat_queries.get_num_unread_messages_for_user(
+                self.chat, self.user2), 3)
+        self.assertEqual(
+            chat_queries.get_num_unread_messages_for_user(
+                self.chat, self.user1), 0)
+
+    def test_marking_read_is_one_update(self):
+        with self.assertNumQueries(1):
+            chat_queries.mark_chat_messages_read_for_user(
+                self.chat, self.user2, self.messages[1].pk)
+        self.assertEqual(
+            chat_queries.get_num_unread_messages_for_user(
+                self.chat, self.user2), 1)
+
+    def test_read_cursor_does_not_move_backward(self):
+        chat_queries.mark_chat_messages_read_for_user(
+            self.chat, self.user2, self.messages[2].pk)
+        chat_queries.mark_chat_messages_read_for_user(
+            self.chat, self.user2, self.messages[0].pk)
+        self.assertEqual(
+            chat_queries.get_num_unread_messages_for_user(
+                self.chat, self.user2), 0)
+
+    def test_viewing_chat_marks_it_read(self):
+        self.client.force_login(self.user2)
+        self.client.get(reverse("chat", kwargs={"pk": self.chat.pk}))
+        self.assertEqual(
+            chat_queries.get_num_unread_messages_for_user(
+                self.chat, self.user2), 0)
+
+
+class ChatMessageHtmlTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.user1)
+
+    def test_message_html_is_escaped_and_urlized(self):
+        message = utils.make_chat_message(
+            self.chat, self.user1, "<b>see</b> https://example.com")
+        self.assertNotIn("<b>", message.message_html)
+        self.assertIn('href="https://example.com"', message.message_html)
+
+    def test_command_renders_unrendered_messages(self):
+        message = utils.make_chat_message(
+            self.chat, self.user1, "https://example.com")
+        models.ChatMessage.objects.filter(pk=message.pk).update(message_html="")
+        call_command("render_chat_messages", stdout=io.StringIO())
+        message.refresh_from_db()
+        self.assertEqual(message.message_html, message.render_message_html())
+
+
+class ChatSendMessageTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        for user in [self.user1, self.user2]:
+            utils.add_chat_participant(self.chat, user)
+        self.client.force_login(self.user1)
+        self.url = reverse("chat", kwargs={"pk": self.chat.pk})
+
+    def test_htmx_send_returns_only_new_message(self):
+        utils.make_chat_message(self.chat, self.user2, "Older message")
+        response = self.client.post(
+            self.url,
+            {"chat": self.chat.pk, "author": self.user1.pk, "message": "Hello"},
+            HTTP_HX_REQUEST="true",
+        )
+        self.assertEqual(response.status_code, 200)
+        message = models.ChatMessage.objects.get(message="Hello")
+        self.assertContains(response, f'data-message-id="{message.pk}"')
+        self.assertNotContains(response, "Older message")
+
+    def test_htmx_send_of_invalid_message_replaces_form(self):
+        response = self.client.post(
+            self.url,
+            {"chat": self.chat.pk, "author": self.user1.pk, "message": ""},
+            HTTP_HX_REQUEST="true",
+        )
+        self.assertEqual(response["HX-Retarget"], "#chat-form")
+        self.assertFalse(models.ChatMessage.objects.exists())
+
+    def test_send_without_htmx_redirects_to_chat(self):
+        response = self.client.post(
+            self.url,
+            {"chat": self.chat.pk, "author": self.user1.pk, "message": "Hello"},
+        )
+        message = models.ChatMessage.objects.get()
+        self.assertRedirects(
+            response, self.url + "#" + message.get_html_id())
+
+    def test_removed_participant_gets_form_error(self):
+        # as if user1 was removed from the chat after the view checked them
+        models.ChatParticipant.objects.filter(
+            chat=self.chat, participant=self.user1).delete()
+        with mock.patch.object(
+                chat_views.Chat, "test_func", return_value=True):
+            response = self.client.post(
+                self.url,
+                {"chat": self.chat.pk, "author": self.user1.pk,
+                 "message": "Hello"},
+                HTTP_HX_REQUEST="true",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["HX-Retarget"], "#chat-form")
+        self.assertContains(response, "not a participant")
+        self.assertFalse(models.ChatMessage.objects.exists())
+
+
+class SendChatMessageTestCase(TestCase):
+    def setUp(self):
+        self.author = utils.make_user("author")
+        self.small_chat = utils.make_chat()
+        self.large_chat = utils.make_chat()
+        utils.add_chat_participant(self.small_chat, self.author)
+        utils.add_chat_participant(self.large_chat, self.author)
+        utils.add_chat_participant(self.small_chat, utils.make_user("user1"))
+        for i in range(5):
+            utils.add_chat_participant(
+                self.large_chat, utils.make_user(f"user{i + 2}"))
+
+    def count_send_queries(self, chat) -> int:
+        message = models.ChatMessage(
+            chat=chat, author=self.author, message="Hello")
+        with CaptureQueriesContext(connection) as queries:
+            chat_queries.send_chat_message(message)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_recipients(self):
+        self.assertEqual(
+            self.count_send_queries(self.small_chat),
+            self.count_send_queries(self.large_chat),
+        )
+        self.assertEqual(
+            models.ChatMessageNotification.objects.filter(
+                message__chat=self.large_chat).count(),
+            5,
+        )
+
+    def test_non_participant_cannot_send(self):
+        message = models.ChatMessage(
+            chat=self.small_chat,
+            author=utils.make_user("outsider"),
+            message="Hello")
+        with self.assertRaises(ValidationError):
+            chat_queries.send_chat_message(message)
+        self.assertFalse(models.ChatMessage.objects.exists())
+
+    def test_stream_is_told_once_committed(self):
+        message = models.ChatMessage(
+            chat=self.small_chat, author=self.author, message="Hello")
+        with mock.patch.object(chat_queries, "publish_chat_message") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                chat_queries.send_chat_message(message)
+                publish.assert_not_called()
+        publish.assert_called_once_with(message)
+
+
+class ChatSearchTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        self.other_chat = utils.make_chat()
+        for user in [self.user1, self.user2]:
+            utils.add_chat_participant(self.chat, user)
+        utils.add_chat_participant(self.other_chat, self.user2)
+        self.message = utils.make_chat_message(
+            self.chat, self.user2, "The sketches are finished")
+        utils.make_chat_message(self.chat, self.user2, "Payment received")
+        utils.make_chat_message(
+            self.other_chat, self.user2, "More sketches coming")
+
+    def test_search_finds_messages_in_own_chats(self):
+        self.assertQuerySetEqual(
+            chat_queries.search_chat_messages_for_user(self.user1, "sketch"),
+            [self.message.pk],
+            transform=lambda message: message.pk,
+        )
+
+    def test_search_results_link_to_message(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(
+            reverse("chat_search"), {"text_query": "sketch"})
+        self.assertContains(response, self.message.get_absolute_url())
+
+
+class ChatArchiveTestCase(TestCase):
+    def setUp(self):
+        self.creator = utils.make_user(
+            "creator", role=models.User.ROLE_CREATOR)
+        self.buyer = utils.make_user("buyer")
+        self.offer = utils.make_offer(self.creator)
+        self.commission = utils.make_commission(
+            self.buyer, self.offer, state=Commission.STATE_CLOSED, validate=False)
+        chat_queries.create_chat_for_commission(self.commission)
+        self.chat = models.Chat.objects.get()
+        self.messages = [
+            utils.make_chat_message(self.chat, self.buyer, "Thank you!"),
+            utils.make_chat_message(self.chat, self.creator, "You're welcome"),
+        ]
+        self.last_year = timezone.now() - datetime.timedelta(days=365)
+        models.ChatMessage.objects.update(created_date=self.last_year)
+
+    def test_inactive_chats_of_closed_commissions_are_archived(self):
+        self.assertQuerySetEqual(
+            chat_queries.get_chats_to_archive(
+                timezone.now() - datetime.timedelta(days=180)),
+            [self.chat],
+        )
+        self.assertQuerySetEqual(
+            chat_queries.get_chats_to_archive(
+                self.last_year - datetime.timedelta(days=1)),
+            [],
+        )
+
+    def test_archive_and_restore(self):
+        archive = chat_queries.archive_chat(self.chat)
+        self.assertEqual(archive.message_count, 2)
+        self.assertFalse(
+            models.ChatMessage.objects.filter(chat=self.chat).exists())
+
+        self.assertTrue(chat_queries.restore_archived_chat(self.chat))
+        restored = list(
+            models.ChatMessage.objects.filter(chat=self.chat).order_by("pk"))
+        self.assertEqual(restored, self.messages)
+        self.assertEqual(
+            [message.message for message in restored],
+            ["Thank you!", "You're welcome"])
+        self.assertEqual(restored[0].created_date, self.last_year)
+        self.assertFalse(models.ChatArchive.objects.exists())
+
+    def test_restoring_twice_restores_once(self):
+        chat_queries.archive_chat(self.chat)
+        self.assertTrue(chat_queries.restore_archived_chat(self.chat))
+        self.assertFalse(chat_queries.restore_archived_chat(self.chat))
+        self.assertEqual(
+            models.ChatMessage.objects.filter(chat=self.chat).count(), 2)
+
+    def test_opening_archived_chat_restores_it(self):
+        chat_queries.archive_chat(self.chat)
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse("chat", kwargs={"pk": self.chat.pk}))
+        self.assertContains(response, "Thank you!")
+
+
+class ChatInboxTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chats = [utils.make_chat() for _ in range(3)]
+        for chat in self.chats:
+            for user in [self.user1, self.user2]:
+                utils.add_chat_participant(chat, user)
+
+    def test_summary_follows_messages(self):
+        utils.make_chat_message(self.chats[0], self.user1, "First")
+        message = utils.make_chat_message(self.chats[0], self.user2, "Second")
+        summary = models.ChatSummary.objects.get(chat=self.chats[0])
+        self.assertEqual(summary.last_message_id, message.pk)
+        self.assertEqual(summary.last_message_author, self.user2)
+        self.assertEqual(summary.last_message_preview, "Second")
+        self.assertEqual(summary.message_count, 2)
+
+    def test_unread_counts(self):
+        for _ in range(3):
+            message = utils.make_chat_message(self.chats[0], self.user1)
+        participation = models.ChatParticipant.objects.get(
+            chat=self.chats[0], participant=self.user2)
+        self.assertEqual(participation.unread_message_count, 3)
+
+        chat_queries.mark_chat_messages_read_for_user(
+            self.chats[0], self.user2, message.pk - 1)
+        participation.refresh_from_db()
+        self.assertEqual(participation.unread_message_count, 1)
+
+    def test_inbox_lists_most_recent_chat_first(self):
+        utils.make_chat_message(self.chats[2], self.user1)
+        utils.make_chat_message(self.chats[0], self.user1)
+        self.assertQuerySetEqual(
+            chat_queries.get_chat_inbox_for_user(self.user2),
+            [self.chats[0].pk, self.chats[2].pk, self.chats[1].pk],
+            transform=lambda participation: participation.chat_id,
+        )
+
+    def test_inbox_queries_do_not_grow_with_chats(self):
+        for chat in self.chats:
+            utils.make_chat_message(chat, self.user1)
+        with self.assertNumQueries(1):
+            list(chat_queries.get_chat_inbox_for_user(self.user2))
+
+
+@override_settings(STORAGES={
+    "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+})
+class ChatAttachmentPreviewTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        for user in [self.user1, self.user2]:
+            utils.add_chat_participant(self.chat, user)
+        image = io.BytesIO()
+        Image.new("RGB", (1200, 800), (200, 100, 50)).save(image, "PNG")
+        self.message = models.ChatMessage(
+            chat=self.chat,
+            author=self.user1,
+            message="My reference sheet",
+            attachment=SimpleUploadedFile("sheet.png", image.getvalue()),
+        )
+        self.message.full_clean()
+        self.message.save()
+
+    def test_preview_is_not_made_on_upload(self):
+        self.assertFalse(self.message.attachment_preview)
+
+    @mock.patch.object(Image, "MAX_IMAGE_PIXELS", 1000)
+    def test_no_preview_for_decompression_bomb(self):
+        with self.message.attachment.open("rb") as attachment:
+            self.assertIsNone(make_image_preview(
+                attachment, 400, 400))
+
+    def test_truncated_image_still_gets_preview(self):
+        with self.message.attachment.open("rb") as attachment:
+            data = attachment.read()
+        preview = make_image_preview(
+            io.BytesIO(data[:len(data) // 2]), 400, 400)
+        self.assertEqual(Image.open(preview).size, (400, 267))
+
+    def test_preview_is_made_once_on_request(self):
+        self.client.force_login(self.user2)
+        url = reverse("chat_attachment_preview", kwargs={"pk": self.message.pk})
+        response = self.client.get(url)
+        self.message.refresh_from_db()
+        self.assertRedirects(
+            response,
+            self.message.attachment_preview.url,
+            fetch_redirect_response=False)
+        with self.message.attachment_preview.open("rb") as preview:
+            width, height = Image.open(preview).size
+        self.assertLessEqual(max(width, height),
+                             models.ChatMessage.ATTACHMENT_PREVIEW_SIZE)
+
+        preview_name = self.message.attachment_preview.name
+        self.client.get(url)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.attachment_preview.name, preview_name)
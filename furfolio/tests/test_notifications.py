@@ -1,6 +1,17 @@
+from unittest import mock
+from django.core import mail
+from django.core.management import call_command
+from django.db import DatabaseError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 from .. import models
+from ..management.commands import notify_offer_followers
+from ..queries import notifications as notification_queries
 from . import utils
+import datetime
+import io
 
 
 class ChatMessageNotificationTestCase(TestCase):
@@ -35,6 +46,560 @@ class ChatMessageNotificationTestCase(TestCase):
             models.Notification.objects.all().count(),
             number_notifications_pre_delete - 1)
 
+    def test_messages_coalesce_into_unseen_notification(self):
+        first_message = utils.make_chat_message(self.chat, self.user1)
+        for _ in range(3):
+            utils.make_chat_message(self.chat, self.user1)
+        message_notification = models.ChatMessageNotification.objects.get()
+        self.assertEqual(message_notification.message, first_message)
+        self.assertEqual(message_notification.message_count, 4)
+        self.assertEqual(
+            message_notification.notification.payload["message_count"], 4)
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.get_num_unread_notifications(), 1)
+
+    def test_message_after_seen_creates_notification(self):
+        utils.make_chat_message(self.chat, self.user1)
+        notification_queries.make_chat_message_notifications_seen_for_user_and_chat(
+            self.chat, self.user2)
+        utils.make_chat_message(self.chat, self.user1)
+        self.assertQuerySetEqual(
+            models.ChatMessageNotification.objects.order_by("pk"),
+            [(True, 1), (False, 1)],
+            transform=lambda message_notification: (
+                message_notification.notification.seen,
+                message_notification.message_count),
+        )
+
+    def test_make_chat_message_notifications_seen(self):
+        other_chat = utils.make_chat()
+        utils.add_chat_participant(other_chat, self.user1)
+        utils.add_chat_participant(other_chat, self.user2)
+        for _ in range(3):
+            utils.make_chat_message(self.chat, self.user1)
+        utils.make_chat_message(other_chat, self.user1)
+
+        with self.assertNumQueries(3):
+            notification_queries.make_chat_message_notifications_seen_for_user_and_chat(
+                self.chat, self.user2)
+        self.assertEqual(
+            notification_queries.get_num_unread_notifications_for_user(
+                self.user2), 1)
+
+        # with nothing left to clear, only check
+        with self.assertNumQueries(1):
+            notification_queries.make_chat_message_notifications_seen_for_user_and_chat(
+                self.chat, self.user2)
+
+
+class UnreadNotificationCountTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.user1)
+        utils.add_chat_participant(self.chat, self.user2)
+
+    def assertUnreadCount(self, user, count):
+        user.refresh_from_db()
+        self.assertEqual(user.get_num_unread_notifications(), count)
+        self.assertEqual(
+            notification_queries.get_num_unread_notifications_for_user(user),
+            count)
+
+    def test_count_follows_notifications(self):
+        for _ in range(3):
+            utils.make_chat_message(self.chat, self.user1)
+        # the messages share one notification
+        self.assertUnreadCount(self.user2, 1)
+
+        notification_queries.make_notification_seen(
+            models.Notification.objects.get(recipient=self.user2))
+        self.assertUnreadCount(self.user2, 0)
+
+        utils.make_chat_message(self.chat, self.user1)
+        utils.make_notification(self.user2)
+        self.assertUnreadCount(self.user2, 2)
+
+        models.ChatMessageNotification.objects.get(
+            notification__recipient=self.user2,
+            notification__seen=False).delete()
+        self.assertUnreadCount(self.user2, 1)
+
+        utils.make_chat_message(self.chat, self.user1)
+        notification_queries.make_chat_message_notifications_seen_for_user_and_chat(
+            self.chat, self.user2)
+        self.assertUnreadCount(self.user2, 1)
+
+    def test_saving_user_keeps_count(self):
+        stale_user = models.User.objects.get(pk=self.user2.pk)
+        utils.make_chat_message(self.chat, self.user1)
+        stale_user.profile = "Updated profile"
+        stale_user.save()
+        self.assertUnreadCount(self.user2, 1)
+
+    def test_repair(self):
+        utils.make_chat_message(self.chat, self.user1)
+        models.User.objects.filter(pk=self.user2.pk).update(
+            unread_notification_count=7)
+        self.assertEqual(
+            notification_queries.repair_num_unread_notifications_for_users(), 1)
+        self.assertUnreadCount(self.user2, 1)
+
+    def test_badge_shows_count(self):
+        utils.make_chat_message(self.chat, self.user1)
+        self.client.force_login(self.user2)
+        response = self.client.get(reverse("notifications_count_component"))
+        self.assertContains(response, "1")
+
+
+class NotificationListTestCase(TestCase):
+    def setUp(self):
+        self.creator = utils.make_user(
+            "creator", role=models.User.ROLE_CREATOR)
+        self.user = utils.make_user("user")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.creator)
+        utils.add_chat_participant(self.chat, self.user)
+        utils.make_user_follow_user(self.user, self.creator)
+        self.client.force_login(self.user)
+
+    def notify(self):
+        utils.make_chat_message(self.chat, self.creator)
+        utils.make_offer(self.creator)
+        notification_queries.notify_pending_offer_followers()
+
+    def count_page_queries(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("notifications"))
+        return len(queries)
+
+    def test_payload_is_stored_at_creation(self):
+        utils.make_chat_message(self.chat, self.creator)
+        notification = models.Notification.objects.get(recipient=self.user)
+        self.assertEqual(
+            notification.kind, models.Notification.KIND_CHAT_MESSAGE)
+        message = models.ChatMessage.objects.get()
+        self.assertEqual(notification.payload["author"], self.creator.pk)
+        self.assertEqual(notification.payload["message"], message.pk)
+        self.assertEqual(
+            notification.get_content_url(), message.get_absolute_url())
+
+    def test_details_follow_renamed_users(self):
+        utils.make_chat_message(self.chat, self.creator)
+        self.creator.username = "renamed"
+        self.creator.save()
+        notification, = notification_queries.resolve_notification_details(
+            models.Notification.objects.filter(recipient=self.user))
+        self.assertEqual(notification.details["author"].username, "renamed")
+
+    def test_page_queries_do_not_grow_with_notifications(self):
+        self.notify()
+        few_notifications_queries = self.count_page_queries()
+        self.notify()
+        for _ in range(3):
+            utils.make_chat_message(self.chat, self.creator)
+        self.assertEqual(
+            self.count_page_queries(), few_notifications_queries)
+
+
+class MarkAllNotificationsSeenTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        for _ in range(5):
+            utils.make_notification(self.user2)
+        utils.make_notification(self.user1)
+
+    @mock.patch.object(notification_queries, "MARK_ALL_SEEN_CHUNK_SIZE", 2)
+    def test_marks_all_seen_in_chunks(self):
+        notification_queries.make_all_notifications_seen_for_user(self.user2)
+        self.assertFalse(models.Notification.objects.filter(
+            recipient=self.user2, seen=False).exists())
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.get_num_unread_notifications(), 0)
+        # notifications of others are untouched
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.get_num_unread_notifications(), 1)
+
+
+class PurgeNotificationsTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        # messages of one chat would share a notification
+        for _ in range(3):
+            chat = utils.make_chat()
+            utils.add_chat_participant(chat, self.user1)
+            utils.add_chat_participant(chat, self.user2)
+            utils.make_chat_message(chat, self.user1)
+        self.old_seen, self.old_unseen, self.recent_seen = \
+            models.Notification.objects.order_by("pk")
+        last_year = timezone.now() - datetime.timedelta(days=365)
+        models.Notification.objects.filter(
+            pk__in=[self.old_seen.pk, self.old_unseen.pk],
+        ).update(created_date=last_year)
+        models.Notification.objects.filter(
+            pk__in=[self.old_seen.pk, self.recent_seen.pk]).update(seen=True)
+
+    @mock.patch.object(notification_queries, "PURGE_CHUNK_SIZE", 1)
+    def test_purges_old_seen_notifications(self):
+        purged = notification_queries.purge_seen_notifications(
+            timezone.now() - datetime.timedelta(days=90))
+        self.assertEqual(purged, 1)
+        self.assertQuerySetEqual(
+            models.Notification.objects.order_by("pk"),
+            [self.old_unseen.pk, self.recent_seen.pk],
+            transform=lambda notification: notification.pk,
+        )
+        self.assertEqual(models.ChatMessageNotification.objects.count(), 2)
+
+
+class NotificationDigestTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1", email="user1@furfolio.net")
+        self.user1.email_notification_digest = True
+        self.user1.save()
+        self.user2 = utils.make_user("user2", email="user2@furfolio.net")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.user1)
+        utils.add_chat_participant(self.chat, self.user2)
+
+    def send_digests(self):
+        call_command("send_notification_digests", stdout=io.StringIO())
+
+    def test_sends_digest_to_opted_in_users_only(self):
+        utils.make_chat_message(self.chat, self.user2)
+        utils.make_chat_message(self.chat, self.user1)
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["user1@furfolio.net"])
+        self.assertIn('User "user2" wrote to chat', mail.outbox[0].body)
+
+    def test_never_sends_notification_twice(self):
+        utils.make_chat_message(self.chat, self.user2)
+        self.send_digests()
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 1)
+
+        other_chat = utils.make_chat()
+        utils.add_chat_participant(other_chat, self.user1)
+        utils.add_chat_participant(other_chat, self.user2)
+        utils.make_chat_message(other_chat, self.user2)
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("1 new notification:", mail.outbox[1].body)
+
+    def test_includes_message_coalesced_after_digest(self):
+        utils.make_chat_message(self.chat, self.user2)
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 1)
+
+        # updates the notification that was in the last digest
+        utils.make_chat_message(self.chat, self.user2)
+        self.assertEqual(
+            models.Notification.objects.filter(recipient=self.user1).count(),
+            1)
+        self.send_digests()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("(2 messages)", mail.outbox[1].body)
+
+    @mock.patch.object(notification_queries, "DIGEST_MAX_NOTIFICATIONS", 1)
+    def test_builds_digests_in_constant_queries(self):
+        user3 = utils.make_user("user3", email="user3@furfolio.net")
+        user3.email_notification_digest = True
+        user3.save()
+        # messages of one chat would share a notification
+        for _ in range(3):
+            chat = utils.make_chat()
+            utils.add_chat_participant(chat, self.user1)
+            utils.add_chat_participant(chat, self.user2)
+            utils.add_chat_participant(chat, user3)
+            utils.make_chat_message(chat, self.user2)
+        # the users and their notifications, the authors and chats of the
+        # notifications, then the users after the last chunk
+        with self.assertNumQueries(5):
+            users = [
+                user for chunk in notification_queries.get_notification_digests()
+                for user in chunk
+            ]
+        self.assertEqual(users, [self.user1, user3])
+        self.assertEqual(len(users[0].digest_notifications), 1)
+        self.assertEqual(users[0].num_digest_notifications, 3)
+
+
+class OpenNotificationTestCase(TestCase):
+    def setUp(self):
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.chat = utils.make_chat()
+        utils.add_chat_participant(self.chat, self.user1)
+        utils.add_chat_participant(self.chat, self.user2)
+        self.message = utils.make_chat_message(self.chat, self.user1)
+        self.notification = models.Notification.objects.get(
+            recipient=self.user2)
+        self.url = reverse(
+            "open_notification", kwargs={"pk": self.notification.pk})
+
+    def test_open_notification(self):
+        self.client.force_login(self.user2)
+        # the session and the user, then the notification and marking it
+        # seen
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertRedirects(
+            response,
+            self.message.get_absolute_url(),
+            fetch_redirect_response=False)
+        self.notification.refresh_from_db()
+        self.assertTrue(self.notification.seen)
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.get_num_unread_notifications(), 0)
+
+        # opening it again does not lower the count again
+        self.client.get(self.url)
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.get_num_unread_notifications(), 0)
+
+    def test_opening_any_kind_takes_same_queries(self):
+        creator = utils.make_user("creator", role=models.User.ROLE_CREATOR)
+        utils.make_user_follow_user(self.user2, creator)
+        offer = utils.make_offer(creator)
+        notification_queries.notify_pending_offer_followers()
+        commission = utils.make_commission(
+            self.user2, offer, models.Commission.STATE_REVIEW)
+        commission.state = models.Commission.STATE_ACCEPTED
+        commission.save()
+        support_ticket = utils.make_support_ticket(
+            self.user2, state=models.SupportTicket.STATE_OPEN)
+        support_ticket.state = models.SupportTicket.STATE_INVESTIGATING
+        support_ticket.save()
+
+        notifications = models.Notification.objects.select_related(
+            "recipient")
+        self.assertEqual(
+            {notification.kind for notification in notifications},
+            {kind for kind, _ in models.Notification.KIND_CHOICES})
+        for notification in notifications:
+            with self.subTest(kind=notification.kind):
+                self.client.force_login(notification.recipient)
+                with self.assertNumQueries(4):
+                    response = self.client.get(
+                        notification.get_absolute_url())
+                self.assertEqual(response.status_code, 302)
+
+    def test_opening_coalesced_notification_shows_all_its_messages(self):
+        messages = [self.message] + [
+            utils.make_chat_message(self.chat, self.user1, f"Message {i}")
+            for i in range(3)
+        ]
+        self.client.force_login(self.user2)
+        response = self.client.get(self.url, follow=True)
+        self.assertFalse(response.context["has_older_messages"])
+        for message in messages:
+            self.assertContains(response, message.get_html_id())
+
+    def test_only_recipient_can_open_notification(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+
+class CreateNotificationsTestCase(TestCase):
+    def setUp(self):
+        self.creator = utils.make_user(
+            "creator", role=models.User.ROLE_CREATOR)
+        self.offer = utils.make_offer(self.creator)
+        self.followers = [utils.make_user(f"user{i}") for i in range(5)]
+        for follower in self.followers:
+            utils.make_user_follow_user(follower, self.creator)
+
+    @mock.patch.object(notification_queries, "NOTIFICATION_BATCH_SIZE", 2)
+    def test_creates_notifications_in_batches(self):
+        # one query for the recipients, then three per batch of two
+        with self.assertNumQueries(10):
+            created = notification_queries.create_offer_posted_notifications(
+                self.offer, models.User.objects.filter(
+                    pk__in=[follower.pk for follower in self.followers]))
+        self.assertEqual(created, 5)
+        self.assertQuerySetEqual(
+            models.OfferPostedNotification.objects.order_by(
+                "notification__recipient"),
+            [follower.pk for follower in self.followers],
+            transform=lambda offer_notification:
+                offer_notification.notification.recipient_id,
+        )
+        for follower in self.followers:
+            follower.refresh_from_db()
+            self.assertEqual(follower.get_num_unread_notifications(), 1)
+
+    def test_accepts_list_of_recipients(self):
+        # one query for the recipients who want the notifications
+        with self.assertNumQueries(4):
+            notification_queries.create_offer_posted_notifications(
+                self.offer, self.followers[:2])
+        self.assertEqual(
+            models.Notification.objects.filter(
+                kind=models.Notification.KIND_OFFER_POSTED).count(),
+            2)
+
+
+class NotificationPreferencesTestCase(TestCase):
+    def setUp(self):
+        self.creator = utils.make_user(
+            "creator", role=models.User.ROLE_CREATOR)
+        self.user1 = utils.make_user("user1")
+        self.user2 = utils.make_user("user2")
+        self.user2.notify_of_chat_messages = False
+        self.user2.notify_of_new_offers = False
+        self.user2.save()
+
+    def assertNotified(self, kind, users):
+        self.assertQuerySetEqual(
+            models.Notification.objects.filter(kind=kind).order_by("recipient"),
+            [user.pk for user in users],
+            transform=lambda notification: notification.recipient_id,
+        )
+
+    def test_muted_users_are_not_notified_of_offers(self):
+        utils.make_user_follow_user(self.user1, self.creator)
+        utils.make_user_follow_user(self.user2, self.creator)
+        utils.make_offer(self.creator)
+        notification_queries.notify_pending_offer_followers()
+        self.assertNotified(
+            models.Notification.KIND_OFFER_POSTED, [self.user1])
+        # other kinds are still sent
+        self.assertNotified(
+            models.Notification.KIND_USER_FOLLOWED, [self.creator, self.creator])
+
+    def test_muted_users_are_not_notified_of_messages(self):
+        chat = utils.make_chat()
+        for user in [self.creator, self.user1, self.user2]:
+            utils.add_chat_participant(chat, user)
+        utils.make_chat_message(chat, self.creator)
+        self.assertNotified(
+            models.Notification.KIND_CHAT_MESSAGE, [self.user1])
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.get_num_unread_notifications(), 0)
+
+    def test_muting_messages_stops_coalescing_into_unseen_notification(self):
+        chat = utils.make_chat()
+        for user in [self.creator, self.user1]:
+            utils.add_chat_participant(chat, user)
+        utils.make_chat_message(chat, self.creator)
+        self.user1.notify_of_chat_messages = False
+        self.user1.save()
+        utils.make_chat_message(chat, self.creator)
+        message_notification = models.ChatMessageNotification.objects.get()
+        self.assertEqual(message_notification.message_count, 1)
+        self.assertEqual(
+            message_notification.notification.payload["message_count"], 1)
+
+
+class NotifyOfferFollowersTestCase(TestCase):
+    def setUp(self):
+        self.creator = utils.make_user(
+            "creator", role=models.User.ROLE_CREATOR)
+        self.followers = [utils.make_user(f"user{i}") for i in range(5)]
+        for follower in self.followers:
+            utils.make_user_follow_user(follower, self.creator)
+        self.offer = utils.make_offer(self.creator)
+
+    def assertNotifiedFollowers(self, followers):
+        self.assertQuerySetEqual(
+            models.OfferPostedNotification.objects.filter(
+                offer=self.offer,
+            ).order_by("notification__recipient"),
+            [follower.pk for follower in followers],
+            transform=lambda offer_notification:
+                offer_notification.notification.recipient_id,
+        )
+
+    @mock.patch.object(notification_queries, "OFFER_FOLLOWERS_CHUNK_SIZE", 2)
+    def test_notifies_followers_in_chunks(self):
+        self.assertTrue(
+            notification_queries.notify_offer_followers_chunk(self.offer.pk))
+        self.assertNotifiedFollowers(self.followers[:2])
+
+        self.assertEqual(
+            notification_queries.notify_pending_offer_followers(), 1)
+        self.assertNotifiedFollowers(self.followers)
+        self.offer.refresh_from_db()
+        self.assertFalse(self.offer.followers_notification_pending)
+
+    def test_rerunning_notifies_no_one_twice(self):
+        call_command("notify_offer_followers", stdout=io.StringIO())
+        call_command("notify_offer_followers", stdout=io.StringIO())
+        self.assertIsNone(
+            notification_queries.notify_offer_followers_chunk(self.offer.pk))
+        self.assertNotifiedFollowers(self.followers)
+
+    def test_skipped_offers_are_not_counted_finished(self):
+        # as if another worker had the offer locked
+        with mock.patch.object(
+                notification_queries, "notify_offer_followers_chunk",
+                return_value=None):
+            self.assertEqual(
+                notification_queries.notify_pending_offer_followers(), 0)
+
+    def test_worker_keeps_running_after_error(self):
+        class Stop(Exception):
+            pass
+
+        stdout = io.StringIO()
+        with mock.patch.object(
+                notification_queries, "notify_pending_offer_followers",
+                side_effect=[DatabaseError, 1]), \
+                mock.patch.object(
+                    notify_offer_followers, "close_old_connections"), \
+                mock.patch("time.sleep", side_effect=[None, Stop]), \
+                self.assertLogs(level="ERROR"), \
+                self.assertRaises(Stop):
+            call_command("notify_offer_followers", forever=True, stdout=stdout)
+        self.assertEqual(
+            stdout.getvalue(), "Notified the followers of 1 offers.\n")
+
+
+class DeleteNotificationsTestCase(TestCase):
+    def setUp(self):
+        self.creator = utils.make_user(
+            "creator", role=models.User.ROLE_CREATOR)
+        self.followers = [utils.make_user(f"user{i}") for i in range(6)]
+        for follower in self.followers[:2]:
+            utils.make_user_follow_user(follower, self.creator)
+        self.quiet_offer = utils.make_offer(self.creator, name="Quiet")
+        notification_queries.notify_pending_offer_followers()
+        for follower in self.followers[2:]:
+            utils.make_user_follow_user(follower, self.creator)
+        self.busy_offer = utils.make_offer(self.creator, name="Busy")
+        notification_queries.notify_pending_offer_followers()
+
+    def count_delete_queries(self, offer) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            offer.delete()
+        return len(queries)
+
+    def test_deleting_busy_offer_runs_bounded_queries(self):
+        self.assertEqual(
+            self.count_delete_queries(self.busy_offer),
+            self.count_delete_queries(self.quiet_offer),
+        )
+        self.assertFalse(models.Notification.objects.filter(
+            kind=models.Notification.KIND_OFFER_POSTED).exists())
+        for follower in self.followers:
+            follower.refresh_from_db()
+            self.assertEqual(follower.get_num_unread_notifications(), 0)
+
+    def test_deleting_notifications_lowers_unread_counts(self):
+        models.Notification.objects.filter(
+            recipient=self.followers[0],
+            kind=models.Notification.KIND_OFFER_POSTED,
+        ).delete()
+        self.followers[0].refresh_from_db()
+        self.assertEqual(self.followers[0].get_num_unread_notifications(), 0)
+        self.assertFalse(models.OfferPostedNotification.objects.filter(
+            notification__recipient=self.followers[0]).exists())
+
 
 class OfferPostedNotificationTestCase(TestCase):
     def setUp(self):
@@ -44,11 +609,15 @@ class OfferPostedNotificationTestCase(TestCase):
 
     def test_offer_creates_offer_posted_notification(self):
         self.offer = utils.make_offer(self.user1)
+        # followers are notified in the background
+        self.assertFalse(models.OfferPostedNotification.objects.exists())
+        notification_queries.notify_pending_offer_followers()
         self.assertEquals(
             models.OfferPostedNotification.objects.all().count(), 1)
 
     def test_delete_offer_posted_notification_deletes_parent(self):
         self.offer = utils.make_offer(self.user1)
+        notification_queries.notify_pending_offer_followers()
 
         # before delete
         self.assertEquals(
@@ -7,6 +7,7 @@ from django.core import mail
 from . import utils
 from .. import utils as furfolio_utils
 from .. import models
+from ..queries import offers as offer_queries
 import datetime
 
 
@@ -43,3 +44,28 @@ class MaxActiveOffersPerUserTestCase(TestCase):
         with self.assertRaises(ValidationError):
             self.__class__.make_max_offers_for_user(
                 self.user, models.Offer.MAX_ACTIVE_OFFERS_PER_USER + 1)
+
+
+class OfferSearchTestCase(TestCase):
+    def setUp(self):
+        self.user = utils.make_user("user", role=models.User.ROLE_CREATOR)
+        self.dragon_offer = utils.make_offer(self.user, name="Dragon sketches")
+        self.cat_offer = utils.make_offer(self.user, name="Cat painting")
+
+    def search(self, text_query):
+        return list(offer_queries.full_text_search_offers(
+            offer_queries.OfferSearchQuery(
+                text_query=text_query,
+                sort=models.Offer.SORT_RELEVANCE,
+            )))
+
+    def test_search_matches_name_and_description(self):
+        self.assertEqual(self.search("dragons"), [self.dragon_offer])
+        self.assertCountEqual(
+            self.search("offer"), [self.dragon_offer, self.cat_offer])
+
+    def test_search_follows_edits(self):
+        self.cat_offer.name = "Dragon painting"
+        self.cat_offer.save()
+        self.assertCountEqual(
+            self.search("dragon"), [self.dragon_offer, self.cat_offer])
@@ -1,4 +1,5 @@
 from .. import models
+from ..queries import chat as chat_queries
 
 
 def make_user(
@@ -94,8 +95,7 @@ def make_chat_message(
 ):
     message = models.ChatMessage(chat=chat, author=author, message=message)
     message.full_clean()
-    message.save()
-    return message
+    return chat_queries.send_chat_message(message)
 
 
 def make_support_ticket(
@@ -118,8 +118,10 @@ def make_support_ticket(
 def make_notification(
     recipient,
     seen=False,
+    kind=models.Notification.KIND_USER_FOLLOWED,
 ):
-    notification = models.Notification(recipient=recipient, seen=seen)
+    notification = models.Notification(
+        recipient=recipient, seen=seen, kind=kind)
     notification.full_clean()
     notification.save()
     return notification
@@ -130,7 +132,7 @@ def make_chat_message_notification(
     message,
 ):
     notification = models.ChatMessageNotification(
-        notification=notification, message=message)
+        notification=notification, chat=message.chat, message=message)
     notification.full_clean()
     notification.save()
     return notification
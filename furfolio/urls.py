@@ -130,11 +130,21 @@ urlpatterns = [
         tags.TagCategory.as_view(),
         name="tag_category_detail"),
     # chat
+    path('chat/', chat.ChatInbox.as_view(), name="chat_inbox"),
+    path('chat/search/', chat.ChatSearch.as_view(), name="chat_search"),
     path('chat/<pk>/', chat.Chat.as_view(), name="chat"),
     path(
         'chat/<pk>/messages/',
         chat.ChatMessagesComponent.as_view(),
         name="chat_messages_component"),
+    path(
+        'chat/<pk>/stream/',
+        chat.ChatMessageStream.as_view(),
+        name="chat_message_stream"),
+    path(
+        'chat/messages/<pk>/attachment-preview/',
+        chat.ChatAttachmentPreview.as_view(),
+        name="chat_attachment_preview"),
     # notifications
     path(
         'notifications/',
@@ -1,15 +1,43 @@
-from typing import Any
+from typing import Any, AsyncIterator, Callable
+import asyncio
+import functools
+import time
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import HttpRequest
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.http import Http404, HttpRequest, HttpResponseRedirect, StreamingHttpResponse
 from django.http.response import HttpResponse as HttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.views import generic
+from ..chat_listener import listener as chat_message_listener
 from ..queries import chat as chat_queries
 from ..queries import notifications as notification_queries
 from .. import models
 from .. import forms
+from .pagination import PageRangeContextMixin, PAGE_SIZE
 
 
-class Chat(LoginRequiredMixin, UserPassesTestMixin, generic.CreateView):
+class MessageCursorMixin:
+    def get_message_cursor(self, name: str) -> int | None:
+        """
+        Returns the message primary key sent as the query parameter `name`,
+        or None if it is missing or not a primary key.
+        """
+        try:
+            return int(self.request.GET[name])
+        except (KeyError, ValueError):
+            return None
+
+
+class Chat(
+        MessageCursorMixin,
+        LoginRequiredMixin,
+        UserPassesTestMixin,
+        generic.CreateView):
     model = models.ChatMessage
     form_class = forms.ChatMessageForm
     template_name = "furfolio/chat/chat.html"
@@ -29,20 +57,91 @@ class Chat(LoginRequiredMixin, UserPassesTestMixin, generic.CreateView):
         return chat_queries.test_user_is_participant_of_chat(
             chat, self.request.user)
 
+    def get(
+            self,
+            request: HttpRequest,
+            *args: Any,
+            **kwargs: Any) -> HttpResponse:
+        # archived chats are restored when they are opened
+        chat_queries.restore_archived_chat(self.get_chat())
+        return super().get(request, *args, **kwargs)
+
+    def is_htmx_request(self) -> bool:
+        return self.request.headers.get("HX-Request") == "true"
+
+    def get_success_url(self) -> str:
+        return reverse("chat", kwargs={"pk": self.object.chat_id}) \
+            + "#" + self.object.get_html_id()
+
+    def form_valid(self, form):
+        try:
+            self.object = chat_queries.send_chat_message(form.instance)
+        except ValidationError as e:
+            # the author left the chat since the page was checked
+            form.add_error(None, e)
+            return self.form_invalid(form)
+        if not self.is_htmx_request():
+            return HttpResponseRedirect(self.get_success_url())
+        # htmx sends messages in place, so only the new message is rendered
+        return render(
+            self.request,
+            "furfolio/chat/messages.html",
+            {"messages": [self.object], "current_user": self.request.user},
+        )
+
+    def form_invalid(self, form):
+        if not self.is_htmx_request():
+            return super().form_invalid(form)
+        response = render(
+            self.request,
+            "furfolio/chat/chat_form.html",
+            {"form": form, "chat": self.get_chat()},
+        )
+        response["HX-Retarget"] = "#chat-form"
+        response["HX-Reswap"] = "outerHTML"
+        return response
+
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
         chat = self.get_chat()
-        context["messages"] = chat_queries.get_messages_from_chat(chat)
+        # a link to a message (see ChatMessage.get_absolute_url) asks for the
+        # chat to show that message, which may be older than the newest page
+        linked_message_pk = self.get_message_cursor("message")
+        linked_message = None
+        if linked_message_pk is not None:
+            linked_message = chat_queries.get_message_from_chat(
+                chat, linked_message_pk)
+        if linked_message is None:
+            messages, has_older_messages = chat_queries.get_chat_message_page(
+                chat)
+        else:
+            messages = list(chat_queries.get_messages_from_chat_since(
+                chat, linked_message))
+            has_older_messages = chat_queries.has_messages_before(
+                chat, linked_message)
+        chat_queries.resolve_concrete_chats([chat])
+        if messages:
+            chat_queries.mark_chat_messages_read_for_user(
+                chat, self.request.user, messages[-1].pk)
+        context["messages"] = messages
+        context["has_older_messages"] = has_older_messages
         context["chat"] = chat
         return context
 
 
 class ChatMessagesComponent(
+        MessageCursorMixin,
         LoginRequiredMixin,
         UserPassesTestMixin,
         generic.TemplateView):
+    """
+    Presents messages of a chat.
+
+    With the `after` query parameter, presents the messages newer than that
+    message. With the `before` query parameter, presents the page of messages
+    older than that message. Otherwise, presents the newest page.
+    """
     model = models.ChatMessage
-    template_name = "furfolio/chat/messages.html"
 
     def get_chat(self):
         return chat_queries.get_chat_by_pk(self.kwargs["pk"])
@@ -52,10 +151,41 @@ class ChatMessagesComponent(
         return chat_queries.test_user_is_participant_of_chat(
             chat, self.request.user)
 
+    def get_template_names(self) -> list[str]:
+        if self.get_message_cursor("after") is not None:
+            return ["furfolio/chat/messages.html"]
+        return ["furfolio/chat/message_page.html"]
+
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
         chat = self.get_chat()
-        context["messages"] = chat_queries.get_messages_from_chat(chat)
+        after = self.get_message_cursor("after")
+        before = self.get_message_cursor("before")
+        if after is not None:
+            messages = list(chat_queries.get_messages_from_chat_after(
+                chat, after))
+            if messages:
+                chat_queries.mark_chat_messages_read_for_user(
+                    chat, self.request.user, messages[-1].pk)
+            context["messages"] = messages
+        elif before is not None:
+            before_message = chat_queries.get_message_from_chat(chat, before)
+            if before_message is None:
+                messages, has_older_messages = [], False
+            else:
+                messages, has_older_messages = chat_queries.get_chat_message_page(
+                    chat, before_message)
+            context["messages"] = messages
+            context["has_older_messages"] = has_older_messages
+        else:
+            messages, has_older_messages = chat_queries.get_chat_message_page(
+                chat)
+            if messages:
+                chat_queries.mark_chat_messages_read_for_user(
+                    chat, self.request.user, messages[-1].pk)
+            context["messages"] = messages
+            context["has_older_messages"] = has_older_messages
+        context["chat"] = chat
         context["current_user"] = self.request.user
         return context
 
@@ -64,8 +194,215 @@ class ChatMessagesComponent(
             request: HttpRequest,
             *args: Any,
             **kwargs: Any) -> HttpResponse:
-        response = super().get(request, *args, **kwargs)
         chat = self.get_chat()
         notification_queries.make_chat_message_notifications_seen_for_user_and_chat(
             chat, self.request.user, )
+        context = self.get_context_data(**kwargs)
+        after = self.get_message_cursor("after")
+        if after is not None and not context["messages"]:
+            # the client is up to date, so there is nothing for it to append
+            return HttpResponse(status=204)
+        return self.render_to_response(context)
+
+
+class ChatAttachmentPreview(
+        LoginRequiredMixin,
+        UserPassesTestMixin,
+        generic.RedirectView):
+    """
+    Redirects to a small preview of the image attached to a chat message.
+    The preview is made the first time it is asked for, not when the
+    message is sent.
+    """
+    # previews do not change, so browsers need not ask again
+    CACHE_SECONDS = 60 * 60 * 24
+
+    def get_message(self) -> 'models.ChatMessage':
+        return get_object_or_404(models.ChatMessage, pk=self.kwargs["pk"])
+
+    def test_func(self):
+        return chat_queries.test_user_is_participant_of_chat(
+            self.get_message().chat, self.request.user)
+
+    def get_redirect_url(self, *args: Any, **kwargs: Any) -> str | None:
+        url = chat_queries.get_attachment_preview_url(self.get_message())
+        if url is None:
+            raise Http404("This attachment has no preview.")
+        return url
+
+    def get(
+            self,
+            request: HttpRequest,
+            *args: Any,
+            **kwargs: Any) -> HttpResponse:
+        response = super().get(request, *args, **kwargs)
+        response["Cache-Control"] = f"private, max-age={self.CACHE_SECONDS}"
+        return response
+
+
+def close_connection_after(function: Callable) -> Callable:
+    """
+    Wraps a function that runs queries so that it closes the database
+    connection of its thread when it returns, for functions that run in
+    between long waits and should not keep a connection meanwhile.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            connection.close()
+    return wrapper
+
+
+class ChatMessageStream(generic.View):
+    """
+    Streams the new messages of a chat as server-sent events.
+
+    Each event holds the rendered messages and has the pk of the newest one
+    as its id, so a reconnecting browser resumes from where it left off.
+    This view must be served by the ASGI application.
+
+    The queries run in the shared thread pool and close their connection
+    when done, so a stream waiting for messages holds neither a thread nor a
+    database connection.
+    """
+    KEEP_ALIVE_SECONDS = 20
+    # end streams after a while and let the browser reconnect, so a stream
+    # whose client went away does not linger
+    MAX_STREAM_SECONDS = 5 * 60
+
+    def get_chat_for_user(self, request: HttpRequest, pk) -> 'models.Chat':
+        if not request.user.is_authenticated:
+            raise PermissionDenied()
+        chat = chat_queries.get_chat_by_pk(pk)
+        if not chat_queries.test_user_is_participant_of_chat(
+                chat, request.user):
+            raise PermissionDenied()
+        return chat
+
+    def get_after_cursor(self, request: HttpRequest) -> int:
+        cursor = request.headers.get(
+            "Last-Event-ID", request.GET.get("after", 0))
+        try:
+            return int(cursor)
+        except ValueError:
+            return 0
+
+    def render_messages_after(
+            self,
+            request: HttpRequest,
+            chat: 'models.Chat',
+            after: int) -> tuple[int, str]:
+        """
+        Returns the pk of the newest message and the event holding the
+        messages after `after`. The event is empty if there are no messages.
+        """
+        messages = list(chat_queries.get_messages_from_chat_after(chat, after))
+        if not messages:
+            return after, ""
+        notification_queries.make_chat_message_notifications_seen_for_user_and_chat(
+            chat, request.user, )
+        chat_queries.mark_chat_messages_read_for_user(
+            chat, request.user, messages[-1].pk)
+        html = render_to_string(
+            "furfolio/chat/messages.html",
+            {"messages": messages, "current_user": request.user},
+        )
+        after = messages[-1].pk
+        data = "".join(f"data: {line}\n" for line in html.splitlines())
+        return after, f"id: {after}\n{data}\n"
+
+    async def stream(
+            self,
+            request: HttpRequest,
+            chat: 'models.Chat',
+            after: int) -> AsyncIterator[str]:
+        render_messages_after = sync_to_async(
+            close_connection_after(self.render_messages_after),
+            thread_sensitive=False)
+        queue = chat_message_listener.subscribe(chat.pk)
+        deadline = time.monotonic() + self.MAX_STREAM_SECONDS
+        try:
+            # catch up on messages sent before the stream subscribed
+            after, event = await render_messages_after(request, chat, after)
+            if event:
+                yield event
+            while time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(
+                        queue.get(), timeout=self.KEEP_ALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # a burst of messages only needs one query
+                while not queue.empty():
+                    queue.get_nowait()
+                after, event = await render_messages_after(request, chat, after)
+                if event:
+                    yield event
+        finally:
+            chat_message_listener.unsubscribe(chat.pk, queue)
+
+    async def get(
+            self,
+            request: HttpRequest,
+            *args: Any,
+            **kwargs: Any) -> HttpResponse:
+        chat = await sync_to_async(
+            close_connection_after(self.get_chat_for_user),
+            thread_sensitive=False)(request, self.kwargs["pk"])
+        response = StreamingHttpResponse(
+            self.stream(request, chat, self.get_after_cursor(request)),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        # tell nginx to pass events through as they are written
+        response["X-Accel-Buffering"] = "no"
         return response
+
+
+class ChatInbox(
+        PageRangeContextMixin,
+        LoginRequiredMixin,
+        generic.ListView):
+    """Lists the chats of the user, the most recently active first."""
+    context_object_name = "participations"
+    template_name = "furfolio/chat/chat_inbox.html"
+    paginate_by = PAGE_SIZE
+
+    def get_queryset(self) -> QuerySet[Any]:
+        return chat_queries.get_chat_inbox_for_user(self.request.user)
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        # load the names of all chats on this page at once
+        chat_queries.resolve_concrete_chats(
+            participation.chat for participation in context["participations"])
+        return context
+
+
+class ChatSearch(
+        PageRangeContextMixin,
+        LoginRequiredMixin,
+        generic.ListView):
+    """Searches the messages of the chats the user participates in."""
+    context_object_name = "messages"
+    template_name = "furfolio/chat/chat_search.html"
+    paginate_by = PAGE_SIZE
+
+    def get_queryset(self) -> QuerySet[Any]:
+        search_form = forms.ChatMessageSearchForm(self.request.GET)
+        text_query = ""
+        if search_form.is_valid():
+            text_query = search_form.cleaned_data["text_query"]
+        return chat_queries.search_chat_messages_for_user(
+            self.request.user, text_query)
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        # load the names of all chats on this page at once
+        chat_queries.resolve_concrete_chats(
+            message.chat for message in context["messages"])
+        context["search_form"] = forms.ChatMessageSearchForm(self.request.GET)
+        return context
@@ -30,10 +30,11 @@ class Notifications(
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         context = super().get_context_data(**kwargs)
+        context["notifications"] = notification_queries.resolve_notification_details(
+            context["notifications"])
         context["search_form"] = NotificationSearchForm(self.request.GET)
 
-        context["exists_unread_notifications"] = notification_queries.get_num_unread_notifications_for_user(
-            self.request.user) > 0
+        context["exists_unread_notifications"] = self.request.user.get_num_unread_notifications() > 0
         return context
 
 
@@ -42,11 +43,15 @@ class OpenNotification(
         UserPassesTestMixin,
         generic.RedirectView):
     def get_notification(self) -> 'models.Notification':
-        return notification_queries.get_notification_by_pk(self.kwargs["pk"])
+        # test_func, get and get_redirect_url all need the notification
+        if not hasattr(self, "notification"):
+            self.notification = notification_queries.get_notification_by_pk(
+                self.kwargs["pk"])
+        return self.notification
 
     def test_func(self) -> bool | None:
         notification = self.get_notification()
-        return notification.recipient.pk == self.request.user.pk
+        return notification.recipient_id == self.request.user.pk
 
     def get_redirect_url(self, *args, **kwargs) -> str | None:
         return self.get_notification().get_content_url()
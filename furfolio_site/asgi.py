@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'furfolio_site.settings')
 
 application = get_asgi_application()
+
+# when developing, serve static files like `manage.py runserver` does
+if settings.DEBUG:
+    application = ASGIStaticFilesHandler(application)
@@ -327,6 +327,12 @@ HONEYPOT_VALUE = "31232451202"
 # words
 AVERAGE_CHARACTERS_PER_WORD = 4.7
 
+# notifications
+# seen notifications older than this many days are purged by the
+# purge_notifications command
+NOTIFICATION_RETENTION_DAYS = int(
+    os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+
 # django-email-verification settings
 # https://github.com/LeoneBacciu/django-email-verification?tab=readme-ov-file#settings-parameters
 